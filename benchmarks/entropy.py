@@ -0,0 +1,93 @@
+"""Measure throughput of the entropy detection engine, in candidate tokens per
+second, over a synthetic corpus of Trello card text
+
+Compares the vectorised numpy entropy calculation with the pure Python fallback,
+over the whole corpus in one batch, in batches of cards as an audit matches a
+search response, and card by card. numpy must be installed for the vectorised results.
+
+Usage:
+    python benchmarks/entropy.py [--cards N] [--seed N]
+"""
+
+import argparse
+import base64
+import random
+import string
+import time
+import uuid
+
+from trello_watchman import entropy
+from trello_watchman import trello_wrapper
+
+WORDS = ('sprint', 'release', 'deploy', 'review', 'customer', 'invoice', 'meeting', 'backlog', 'design', 'api',
+         'server', 'update', 'ticket', 'follow', 'up', 'with', 'the', 'team', 'on', 'monday', 'draft', 'budget',
+         'onboarding', 'checklist', 'staging', 'database', 'migration', 'frontend', 'bug', 'fix', 'qa', 'sign-off')
+
+
+def card_text(rand: random.Random, secret_rate: float) -> str:
+    """Build a card description of a few sentences with the kind of long tokens
+    found in engineering boards: links, commit hashes, UUIDs and encoded blobs,
+    occasionally containing a generic secret"""
+
+    lines = []
+    for _ in range(rand.randint(1, 6)):
+        lines.append(' '.join(rand.choice(WORDS) for _ in range(rand.randint(6, 20))).capitalize() + '.')
+    lines.append(f'https://example.atlassian.net/browse/PROJ-{rand.randint(1, 9999)}')
+    for _ in range(rand.randint(0, 6)):
+        kind = rand.random()
+        if kind < 0.4:
+            lines.append(f'commit {rand.getrandbits(160):040x}')
+        elif kind < 0.7:
+            lines.append(f'request id {uuid.UUID(int=rand.getrandbits(128))}')
+        elif kind < 0.98:
+            lines.append(f'config_value_{"_".join(rand.choice(WORDS) for _ in range(4))}')
+        else:
+            lines.append(base64.b64encode(' '.join(rand.choice(WORDS) for _ in range(12)).encode()).decode())
+    if rand.random() < secret_rate:
+        secret = ''.join(rand.choices(string.ascii_letters + string.digits + '+/', k=40))
+        lines.insert(rand.randint(0, len(lines)), f'secret = {secret}')
+    return '\n'.join(lines)
+
+
+def timed(function, *args) -> tuple:
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cards', type=int, default=50000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--secret-rate', type=float, default=0.02)
+    args = parser.parse_args()
+
+    rand = random.Random(args.seed)
+    cards = [card_text(rand, args.secret_rate) for _ in range(args.cards)]
+    detector = entropy.EntropyDetector()
+    batch_size = trello_wrapper.ENTROPY_BATCH
+
+    candidates, elapsed = timed(lambda: [token.group(0) for text in cards for token in detector.tokenize(text)])
+    print(f'{len(cards)} cards, {sum(map(len, cards)) / 1024 / 1024:.1f}MB, {len(candidates)} candidate tokens, '
+          f'tokenized in {elapsed:.2f}s ({len(candidates) / elapsed:,.0f} tokens/s)')
+
+    numpy = entropy.numpy
+    modes = [('python', None)] + ([('numpy', numpy)] if numpy is not None else [])
+    for name, module in modes:
+        entropy.numpy = module
+        _, batch = timed(entropy.shannon_entropy, candidates)
+        found, batched = timed(lambda: sum(1 for start in range(0, len(cards), batch_size)
+                                           for match in detector.search_many(cards[start:start + batch_size])
+                                           if match))
+        per_card_found, per_card = timed(lambda: sum(1 for text in cards if detector.search(text)))
+        assert found == per_card_found
+        print(f'{name:<7} one batch: {len(candidates) / batch:>12,.0f} tokens/s   '
+              f'{batch_size} cards a batch: {len(candidates) / batched:>10,.0f} tokens/s   '
+              f'card by card: {len(candidates) / per_card:>10,.0f} tokens/s   {found} cards with secrets')
+    entropy.numpy = numpy
+    if numpy is None:
+        print('numpy is not installed, only the pure Python fallback was measured')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""Compare bytes received from Trello using the default endpoint payloads and
+the lean per-endpoint parameters Trello Watchman requests
+
+Needs TRELLO_WATCHMAN_KEY and TRELLO_WATCHMAN_SECRET to be set, and makes
+live requests to the Trello API. Responses are not cached.
+
+Usage:
+    python benchmarks/payload.py QUERY [QUERY ...] [--cards N]
+"""
+
+import argparse
+
+from trello_watchman import trello_wrapper
+
+# Parameters Trello Watchman sent with every request before per-endpoint profiles
+LEGACY_SEARCH_PARAMS = {
+    'cards_limit': 1000,
+    'card_members': 'true',
+    'card_attachments': 'true',
+    'members_limit': 100,
+    'boards_limit': 1000,
+    'board': 'true',
+    'modelTypes': ['cards', 'boards'],
+}
+
+
+def audit(trello: trello_wrapper.TrelloAPI, queries: list, cards: int, lean: bool) -> int:
+    """Make the requests an audit of the given queries makes, without filtering,
+    and return the number of bytes received"""
+
+    trello.bytes_received = 0
+    for query in queries:
+        if lean:
+            card_list = trello.search(query).get('cards')
+        else:
+            card_list = trello._make_request('search', params=dict(LEGACY_SEARCH_PARAMS, query=query)).json().get('cards')
+        for card in card_list[:cards]:
+            if lean:
+                trello.get_board(card.get('idBoard'))
+                trello.get_board_members(card.get('idBoard'))
+                trello.get_card_actions(card.get('id'))
+            else:
+                trello._make_request(f'boards/{card.get("idBoard")}', params=LEGACY_SEARCH_PARAMS)
+                trello._make_request(f'boards/{card.get("idBoard")}/members', params=LEGACY_SEARCH_PARAMS)
+                trello._make_request(f'cards/{card.get("id")}/actions', params=LEGACY_SEARCH_PARAMS)
+    return trello.bytes_received
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('queries', nargs='+')
+    parser.add_argument('--cards', type=int, default=20, help='Cards per query to fetch boards and actions for')
+    args = parser.parse_args()
+
+    trello = trello_wrapper.initiate_trello_connection()
+    legacy = audit(trello, args.queries, args.cards, lean=False)
+    lean = audit(trello, args.queries, args.cards, lean=True)
+    print(f'legacy parameters: {legacy} bytes')
+    print(f'lean parameters:   {lean} bytes ({lean / legacy:.1%} of legacy)')
+
+
+if __name__ == '__main__':
+    main()
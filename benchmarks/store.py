@@ -0,0 +1,77 @@
+"""Measure insert throughput and query latency of the sqlite findings store
+
+Writes synthetic findings across a number of boards and rules to a new
+database, then times typical queries against it.
+
+Usage:
+    python benchmarks/store.py [--findings N] [--boards N] [--rules N] [--db PATH]
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from trello_watchman import models
+from trello_watchman import store
+
+QUERIES = [
+    ('one rule, last 90 days', 'query', {'rules': ['Rule 7'], 'since': '{quarter}'}),
+    ('one board', 'query', {'board_ids': ['board7']}),
+    ('one card', 'query', {'card_ids': ['card7']}),
+    ('severity >= 90, first 100', 'query', {'severity': 90, 'limit': 100}),
+    ('count by board for one rule', 'count', {'group_by': 'board_id', 'rules': ['Rule 7']}),
+    ('count by rule', 'count', {'group_by': 'rule'}),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--findings', type=int, default=1000000)
+    parser.add_argument('--boards', type=int, default=2000)
+    parser.add_argument('--rules', type=int, default=40)
+    parser.add_argument('--db', help='Database to write to, default a temporary file')
+    args = parser.parse_args()
+
+    random.seed(0)
+    temp_dir = None
+    if not args.db:
+        temp_dir = tempfile.TemporaryDirectory()
+        args.db = os.path.join(temp_dir.name, store.DEFAULT_DB_NAME)
+
+    boards = [models.Board(f'board{i}', f'Board {i}', '', False, f'https://trello.com/b/{i}',
+                           (models.Member(f'member{i}', f'user{i}'),)) for i in range(args.boards)]
+    severities = ['30', '50', '70', '70', '70', '90']
+    findings = store.FindingsStore(args.db)
+    started = time.perf_counter()
+    for i in range(args.findings):
+        result = models.TextResult(f'card{i}', '2021-03-09T00:00:00.000Z', 'Card', f'secret = token{i}',
+                                   f'https://trello.com/c/{i}', f'token{i}', random.choice(boards))
+        findings.add(result, 'text', f'Rule {i % args.rules}', severities[i % len(severities)])
+    findings.close()
+    elapsed = time.perf_counter() - started
+    print(f'inserted {args.findings} findings in {elapsed:.2f}s ({args.findings / elapsed:,.0f}/s), '
+          f'database {os.path.getsize(args.db) / 1024 / 1024:.0f}MB')
+
+    findings = store.FindingsStore(args.db)
+    quarter = time.strftime('%Y-%m-%d', time.localtime(time.time() - 90 * 86400))
+    for name, kind, filters in QUERIES:
+        filters = {key: value.format(quarter=quarter) if isinstance(value, str) else value
+                   for key, value in filters.items()}
+        timings = []
+        for _ in range(5):
+            started = time.perf_counter()
+            if kind == 'query':
+                rows = len(list(findings.query(**filters)))
+            else:
+                rows = len(findings.count(**filters))
+            timings.append(time.perf_counter() - started)
+        print(f'{name:<30} {rows:>8} rows {min(timings) * 1000:>10.2f}ms')
+    findings.close()
+    if temp_dir:
+        temp_dir.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -30,6 +30,9 @@ setup(
         'PyYAML',
         'simplejson'
     ],
+    extras_require={
+        'entropy': ['numpy']
+    },
     keywords='audit trello trello-watchman watchman blue-team red-team threat-hunting',
     packages=['trello_watchman'],
     include_package_data=True,
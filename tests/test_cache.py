@@ -0,0 +1,129 @@
+import os
+import stat
+import tempfile
+import time
+import unittest
+
+import requests
+
+from trello_watchman import cache
+from trello_watchman import trello_wrapper
+
+
+def make_response(status_code: int, content: str = '', headers: dict = None) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status_code
+    response.url = 'https://api.trello.com/1/boards/b1'
+    response.encoding = 'utf-8'
+    response._content = content.encode('utf-8')
+    response.headers.update(headers or {})
+    return response
+
+
+class StubSession(object):
+    """Stands in for the requests session, returning queued responses and
+    recording the headers of each request"""
+
+    def __init__(self, responses: list):
+        self.responses = responses
+        self.request_headers = []
+
+    def request(self, method, url, headers=None, **kwargs):
+        self.request_headers.append(headers or {})
+        return self.responses.pop(0)
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.temp_dir.name, 'cache')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def make_connection(self, responses: list, **cache_args) -> trello_wrapper.TrelloAPI:
+        trello = trello_wrapper.TrelloAPI('key', 'token', cache.ResponseCache(self.cache_dir, **cache_args))
+        trello.session = StubSession(responses)
+        return trello
+
+    def test_permissions(self):
+        """Test the cache directory and entries can only be read by their owner"""
+
+        response_cache = cache.ResponseCache(self.cache_dir)
+        response_cache.put('entry', make_response(200, '{"desc": "password = hunter2"}'))
+        self.assertEqual(stat.S_IMODE(os.stat(self.cache_dir).st_mode), 0o700)
+        self.assertEqual(stat.S_IMODE(os.stat(os.path.join(self.cache_dir, 'entry.json')).st_mode), 0o600)
+
+    def test_conditional_revalidation(self):
+        """Test responses with an ETag are revalidated, and a 304 is served from the cache"""
+
+        trello = self.make_connection([make_response(200, '{"id": "b1"}', {'ETag': '"v1"'}),
+                                       make_response(304)])
+        self.assertEqual(trello.get_board('b1'), {'id': 'b1'})
+        self.assertEqual(trello.get_board('b1'), {'id': 'b1'})
+        self.assertNotIn('If-None-Match', trello.session.request_headers[0])
+        self.assertEqual(trello.session.request_headers[1].get('If-None-Match'), '"v1"')
+        self.assertEqual((trello.cache.hits, trello.cache.misses), (1, 1))
+
+    def test_ttl(self):
+        """Test responses without validators are reused without a request until they are older than the TTL"""
+
+        trello = self.make_connection([make_response(200, '{"id": "b1"}'),
+                                       make_response(200, '{"id": "b1", "name": "Renamed"}')])
+        trello.get_board('b1')
+        self.assertEqual(trello.get_board('b1'), {'id': 'b1'})
+        self.assertEqual(len(trello.session.request_headers), 1)
+
+        trello.cache.ttl = 0
+        self.assertEqual(trello.get_board('b1'), {'id': 'b1', 'name': 'Renamed'})
+        self.assertEqual(trello.session.request_headers[1], {})
+        self.assertEqual((trello.cache.hits, trello.cache.misses), (1, 2))
+
+    def test_run_connection(self):
+        """Test a run connection shares the session and cache, interns its own boards,
+        and counts its requests in its own and the shared connection's totals"""
+
+        trello = self.make_connection([make_response(200, '{"id": "b1"}'), make_response(200, '{"id": "b2"}')])
+        trello.boards['b1'] = 'board'
+        trello.get_board('b1')
+        run_connection = trello.for_run()
+        run_connection.get_board('b2')
+        self.assertIs(run_connection.session, trello.session)
+        self.assertIs(run_connection.cache, trello.cache)
+        self.assertEqual((run_connection.boards, trello.boards), ({}, {'b1': 'board'}))
+        self.assertEqual((run_connection.requests_made, trello.requests_made), (1, 2))
+        self.assertEqual(trello.bytes_received, len('{"id": "b1"}{"id": "b2"}'))
+
+    def test_overwrite_size(self):
+        """Test the cache size counts an overwritten entry once"""
+
+        response_cache = cache.ResponseCache(self.cache_dir)
+        response_cache.put('entry', make_response(200, 'a' * 1000))
+        response_cache.put('entry', make_response(200, 'a' * 10))
+        self.assertEqual(response_cache._size, os.path.getsize(os.path.join(self.cache_dir, 'entry.json')))
+        self.assertEqual(cache.ResponseCache(self.cache_dir)._size, response_cache._size)
+
+    def test_eviction(self):
+        """Test the least recently used entries are removed once the cache is over its maximum size,
+        until it is at most 90% full"""
+
+        response_cache = cache.ResponseCache(self.cache_dir, max_size=10 ** 6)
+        now = time.time()
+        for i in range(10):
+            response_cache.put(f'entry{i}', make_response(200, 'a' * 900))
+            os.utime(os.path.join(self.cache_dir, f'entry{i}.json'), (now - 100 + i, now - 100 + i))
+        entry_size = response_cache._size // 10
+        # Using an entry makes it the most recently used
+        response_cache.hit('entry0', response_cache.get('entry0'))
+
+        response_cache.max_size = entry_size * 10 + 100
+        response_cache.put('entry10', make_response(200, 'a' * 900))
+        remaining = sorted(os.path.splitext(name)[0] for name in os.listdir(self.cache_dir))
+        self.assertEqual(remaining, ['entry0', 'entry10'] + [f'entry{i}' for i in range(3, 10)])
+        self.assertLessEqual(response_cache._size, response_cache.max_size * 0.9)
+        sizes = [os.path.getsize(os.path.join(self.cache_dir, name)) for name in os.listdir(self.cache_dir)]
+        self.assertEqual(response_cache._size, sum(sizes))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import tempfile
+import unittest
+import simplejson as json
+
+import trello_watchman
+from trello_watchman import logger
+from trello_watchman import models
+from trello_watchman import rule
+
+
+def make_rule(name: str) -> rule.Rule:
+    meta = type('meta', (), {'name': name, 'severity': '90'})
+    return rule.Rule(f'{name}.yaml', True, meta, ['text'], None, ['key'], 'key')
+
+
+class TestCompactOutput(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.output = logger.FileLogger(self.temp_dir.name)
+        self.output_logger, trello_watchman.OUTPUT_LOGGER = trello_watchman.OUTPUT_LOGGER, self.output
+        members = (models.Member('m1', 'robertbaratheon'),)
+        self.boards = [models.Board('b1', 'Westeros Board', '', False, 'https://trello.com/b/1', members),
+                       models.Board('b2', 'Essos Board', '', False, 'https://trello.com/b/2', members)]
+
+    def tearDown(self):
+        self.output.logger.removeHandler(self.output.handler)
+        self.output.handler.close()
+        trello_watchman.OUTPUT_LOGGER = self.output_logger
+        self.temp_dir.cleanup()
+
+    def make_results(self) -> list:
+        return [models.TextResult(f'c{i}', '2021-03-09T00:00:00.000Z', 'Title', f'key = secret{i}',
+                                  f'https://trello.com/c/{i}', f'secret{i}', self.boards[i % 2]) for i in range(4)]
+
+    def read_log(self) -> list:
+        with open(os.path.join(self.temp_dir.name, 'trello_watchman.log')) as log_file:
+            return [json.loads(line) for line in log_file]
+
+    def test_boards_logged_once(self):
+        """Test each board is logged once per run, across rules and scopes, before the results on it"""
+
+        logged_boards = set()
+        trello_watchman.log_results(self.make_results(), 'text', make_rule('AWS Access Keys'), True, logged_boards)
+        trello_watchman.log_results(self.make_results(), 'attachments', make_rule('Slack API Tokens'), True,
+                                    logged_boards)
+        self.assertEqual(logged_boards, {'b1', 'b2'})
+
+        records = self.read_log()
+        boards = [record.get('board_data') for record in records if record.get('level') == 'BOARD']
+        self.assertEqual([board.get('id') for board in boards], ['b1', 'b2'])
+        self.assertEqual(boards[0], self.boards[0]._asdict())
+        self.assertEqual(len([record for record in records if record.get('level') == 'NOTIFY']), 8)
+        self.assertEqual(records[0].get('level'), 'BOARD')
+
+    def test_boards_logged_each_run(self):
+        """Test boards are logged again by a later run, such as the next run of a daemon job"""
+
+        for _ in range(2):
+            trello_watchman.log_results(self.make_results(), 'text', make_rule('AWS Access Keys'), True, set())
+        boards = [record.get('board_data').get('id') for record in self.read_log() if record.get('level') == 'BOARD']
+        self.assertEqual(boards, ['b1', 'b2', 'b1', 'b2'])
+
+    def test_results_reference_board(self):
+        """Test compact results reference their board by ID instead of embedding it"""
+
+        trello_watchman.log_results(self.make_results(), 'text', make_rule('AWS Access Keys'), True)
+        findings = [record.get('detection_data') for record in self.read_log() if record.get('level') == 'NOTIFY']
+        self.assertEqual([finding.get('board_id') for finding in findings], ['b1', 'b2', 'b1', 'b2'])
+        self.assertTrue(all('board' not in finding for finding in findings))
+        self.assertEqual(findings[0].get('match_string'), 'secret0')
+
+    def test_full_output(self):
+        """Test results embed their board and no boards are logged separately without compact"""
+
+        trello_watchman.log_results(self.make_results(), 'text', make_rule('AWS Access Keys'), False)
+        records = self.read_log()
+        self.assertFalse([record for record in records if record.get('level') == 'BOARD'])
+        self.assertEqual(records[1].get('detection_data').get('board'), self.boards[1]._asdict())
+        self.assertNotIn('board_id', records[1].get('detection_data'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+
+import trello_watchman
+from trello_watchman import daemon
+from trello_watchman import logger
+from trello_watchman import rule
+from trello_watchman import trello_wrapper
+
+
+class TestDaemon(unittest.TestCase):
+    def test_parse_interval(self):
+        """Test job intervals are converted to seconds"""
+
+        self.assertEqual(daemon.parse_interval('30m'), 1800)
+        self.assertEqual(daemon.parse_interval('1w'), 604800)
+        self.assertEqual(daemon.parse_interval(90), 90)
+        for interval in ('0h', 'hourly', '1y', None):
+            with self.assertRaises(Exception):
+                daemon.parse_interval(interval)
+
+    def test_job_selects(self):
+        """Test jobs select rules by category or filename"""
+
+        job = daemon.Job('tokens', ['tokens', 'passwords'], 3600)
+        self.assertTrue(job.selects(SimpleNamespace(category='tokens', filename='aws_tokens.yaml')))
+        self.assertTrue(job.selects(SimpleNamespace(category='pii', filename='passwords.yaml')))
+        self.assertFalse(job.selects(SimpleNamespace(category='pii', filename='bank_cards.yaml')))
+
+    def test_search_back(self):
+        """Test the first run searches back one interval or its timeframe, and later runs
+        only search back to shortly before the last successful run started"""
+
+        job = daemon.Job('tokens', ['tokens'], 3600)
+        self.assertEqual(job.search_back(1000000), 3600 + daemon.RUN_OVERLAP)
+        self.assertEqual(job.search_back(1000000, first_run=86400), 86400)
+        job.last_started = 1000000
+        self.assertEqual(job.search_back(1003600.5, first_run=86400), 3600 + daemon.RUN_OVERLAP)
+        with self.assertRaises(Exception):
+            daemon.Job('tokens', ['tokens'], 3600, timeframe='y')
+
+    def test_run_job(self):
+        """Test each job run searches with its own connection, leaving the shared connection alone,
+        and the next run searches back to shortly before the last run started"""
+
+        searches = []
+        output = logger.StdoutLogger()
+        output.log_info = lambda message: None
+        output_logger, trello_watchman.OUTPUT_LOGGER = trello_watchman.OUTPUT_LOGGER, output
+        find_text = trello_wrapper.find_text
+        trello_wrapper.find_text = lambda trello, log_handler, rule_definition, tf, board_ids=None, \
+            organization_ids=None: searches.append((trello, tf))
+        try:
+            connection = trello_wrapper.TrelloAPI('key', 'token')
+            connection.boards['b1'] = 'board'
+            meta = SimpleNamespace(name='Slack API Tokens', severity='90')
+            rules_list = [rule.Rule('slack_api_tokens.yaml', True, meta, ['text'], None, ['xox'], 'xox[a-z]+',
+                                    category='tokens')]
+            job = daemon.Job('tokens', ['tokens'], 3600, scopes=['text'])
+            for _ in range(2):
+                trello_watchman.run_job(connection, rules_list, job)
+        finally:
+            trello_wrapper.find_text = find_text
+            trello_watchman.OUTPUT_LOGGER = output_logger
+
+        self.assertEqual(len(searches), 2)
+        self.assertIsNot(searches[0][0], connection)
+        self.assertIsNot(searches[0][0], searches[1][0])
+        self.assertEqual(connection.boards, {'b1': 'board'})
+        self.assertEqual(searches[0][1], 3600 + daemon.RUN_OVERLAP)
+        self.assertLessEqual(searches[1][1], daemon.RUN_OVERLAP + 1)
+        self.assertIsNotNone(job.last_started)
+
+    def test_scheduler_prevents_overlap(self):
+        """Test a job that runs longer than its interval is never run concurrently with itself"""
+
+        active = []
+        overlaps = []
+
+        def run_job(job):
+            active.append(job)
+            if active.count(job) > 1:
+                overlaps.append(job)
+            time.sleep(0.25)
+            active.remove(job)
+
+        slow = daemon.Job('slow', ['tokens'], 1)
+        slow.interval = 0.1
+        fast = daemon.Job('fast', ['pii'], 1)
+        fast.interval = 0.1
+        scheduler = daemon.Scheduler([slow, fast], run_job, output=lambda message: None)
+        thread = threading.Thread(target=scheduler.run)
+        thread.start()
+        time.sleep(0.6)
+        scheduler.stop()
+        thread.join()
+
+        self.assertEqual(overlaps, [])
+        self.assertGreaterEqual(scheduler.runs.get('slow'), 2)
+        self.assertGreaterEqual(scheduler.runs.get('fast'), 2)
+        self.assertGreater(scheduler.skipped.get('slow'), 0)
+
+    def test_rate_limiter(self):
+        """Test requests beyond the burst are spread out at the limiter's rate"""
+
+        limiter = trello_wrapper.RateLimiter(requests=20, period=1, burst=5)
+        started = time.monotonic()
+        for _ in range(20):
+            limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - started, 0.9)
+        self.assertGreater(limiter.waited, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
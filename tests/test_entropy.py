@@ -0,0 +1,82 @@
+import math
+import random
+import string
+import unittest
+
+from trello_watchman import entropy
+
+
+class TestEntropy(unittest.TestCase):
+    def setUp(self):
+        random.seed(0)
+        self.tokens = [''.join(random.choices(string.ascii_letters + string.digits + '+/', k=random.randint(1, 80)))
+                       for _ in range(5000)] + ['a', 'ab', 'aaaa', 'abcd' * 10]
+
+    def test_shannon_entropy(self):
+        """Test entropies are calculated in bits per character"""
+
+        values = entropy.shannon_entropy(['a', 'ab', 'aaaa', 'abcd' * 10, '0123456789abcdef'])
+        for value, expected in zip(values, [0, 1, 0, 2, 4]):
+            self.assertAlmostEqual(value, expected)
+
+    @unittest.skipIf(entropy.numpy is None, 'numpy is not installed')
+    def test_numpy_matches_python(self):
+        """Test the vectorised entropies match the pure Python ones, across token batches"""
+
+        vectorised = entropy._entropies_numpy(self.tokens)
+        for value, expected in zip(vectorised, entropy._entropies_python(self.tokens)):
+            self.assertTrue(math.isclose(value, expected, abs_tol=1e-9))
+
+    def test_detector(self):
+        """Test the detector finds high entropy tokens and skips low entropy tokens and URLs"""
+
+        detector = entropy.EntropyDetector()
+        self.assertEqual(detector.search('secret = "hJ4kL9mN2pQ8rS5tU7vW1xY3zA6bC0dE";').group(0),
+                         'hJ4kL9mN2pQ8rS5tU7vW1xY3zA6bC0dE')
+        self.assertIsNone(detector.search('secret = aaaabbbbccccddddeeeeffffgggghhhh'))
+        self.assertIsNone(detector.search('secret = config_value_release_staging_database'))
+        self.assertIsNone(detector.search('https://trello.com/c/hJ4kL9mN2pQ8rS5tU7vW1xY3zA6bC0dE/secret'))
+        self.assertIsNotNone(entropy.EntropyDetector(ignore_urls=False).search(
+            'https://trello.com/c/hJ4kL9mN2pQ8rS5tU7vW1xY3zA6bC0dE/secret'))
+        self.assertEqual(entropy.EntropyDetector('hex').search('md5 5d41402abc4b2a76b9719d911017c592').group(0),
+                         '5d41402abc4b2a76b9719d911017c592')
+        with self.assertRaises(Exception):
+            entropy.EntropyDetector('unicode')
+
+    def test_detector_min_length(self):
+        """Test the minimum length is long enough for tokens to reach the threshold"""
+
+        self.assertEqual(entropy.EntropyDetector().min_length, 23)
+        self.assertEqual(entropy.EntropyDetector('hex').min_length, entropy.DEFAULT_MIN_LENGTH)
+        self.assertEqual(entropy.EntropyDetector(threshold=3.0, min_length=8).tokenize('token 0123456789')[0].group(0),
+                         '0123456789')
+        # A 20 character token scores at most log2(20) = 4.32 bits per character
+        with self.assertRaises(Exception):
+            entropy.EntropyDetector(threshold=4.5, min_length=20)
+
+    def test_search_many(self):
+        """Test searching texts in one batch finds the same tokens as searching them one at a time"""
+
+        detector = entropy.EntropyDetector(threshold=4.0)
+        texts = [' '.join(self.tokens[i:i + 3]) for i in range(0, len(self.tokens), 3)] + ['', 'no tokens here']
+        expected = [detector.search(text) for text in texts]
+        self.assertEqual([match and match.span() for match in detector.search_many(texts)],
+                         [match and match.span() for match in expected])
+        self.assertTrue(any(expected))
+        self.assertFalse(all(expected))
+
+    def test_detector_without_numpy(self):
+        """Test the detector gives the same results with the pure Python fallback"""
+
+        detector = entropy.EntropyDetector()
+        text = ' '.join(self.tokens)
+        expected = detector.search(text)
+        numpy, entropy.numpy = entropy.numpy, None
+        try:
+            self.assertEqual(detector.search(text).span(), expected.span())
+        finally:
+            entropy.numpy = numpy
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+import simplejson as json
+
+from trello_watchman import jsonstream
+
+
+def chunked(data: bytes, size: int) -> list:
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class TestJsonStream(unittest.TestCase):
+    def test_iter_array(self):
+        """Test array elements are decoded the same as a full decode, for any chunk size"""
+
+        document = {
+            'options': {'terms': [{'text': '"cards":[ ünïcödé'}], 'modelTypes': ['cards'], 'partial': False},
+            'cards': [{'id': str(i), 'desc': f'card {i} ✓', 'attachments': [{'id': i}], 'pos': 16384.5 * i}
+                      for i in range(50)],
+            'total': 123456
+        }
+        data = json.dumps(document, indent=1).encode('utf-8')
+        for size in (1, 2, 3, 7, 64, len(data)):
+            self.assertEqual(list(jsonstream.iter_array(chunked(data, size), 'cards')), document.get('cards'),
+                             msg=f'Chunk size {size}')
+
+    def test_iter_array_numbers(self):
+        """Test top level numbers are decoded the same as a full decode when split at any position"""
+
+        numbers = [16384.5, -0.25, 1e+21, 2.5E-7, -12, 0, 123456789]
+        data = json.dumps({'cards': numbers, 'total': -1.5e+300}).encode('utf-8')
+        for split in range(1, len(data)):
+            self.assertEqual(list(jsonstream.iter_array([data[:split], data[split:]], 'cards')), numbers,
+                             msg=f'Split at {split}: {data[:split]!r}')
+        self.assertEqual(list(jsonstream.iter_array([b'{"cards": [16384.', b'5]}'], 'cards')), [16384.5])
+
+    def test_iter_array_empty_or_missing(self):
+        """Test empty and missing arrays yield nothing"""
+
+        self.assertEqual(list(jsonstream.iter_array([b'{"cards": []}'], 'cards')), [])
+        self.assertEqual(list(jsonstream.iter_array([b'{"boards": [1, 2]}'], 'cards')), [])
+        self.assertEqual(list(jsonstream.iter_array([b'{}'], 'cards')), [])
+
+    def test_iter_array_truncated(self):
+        """Test truncated documents raise an error"""
+
+        with self.assertRaises(ValueError):
+            list(jsonstream.iter_array([b'{"cards": [{"id": "1"}, {"id": '], 'cards'))
+
+
+if __name__ == '__main__':
+    unittest.main()
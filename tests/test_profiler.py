@@ -0,0 +1,102 @@
+import concurrent.futures
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from trello_watchman import profiler
+
+
+def _busy_worker(n: int) -> int:
+    with profiler.phase('filtering'):
+        return sum(i * i for i in range(n))
+
+
+class TestProfiler(unittest.TestCase):
+    def tearDown(self):
+        profiler.stop()
+
+    def test_nested_phases(self):
+        """Test nested phases count towards the total time of the phase they are in, but not its self time"""
+
+        audit_profile = profiler.start()
+        with profiler.phase('search'):
+            time.sleep(0.02)
+            for _ in range(2):
+                with profiler.phase('network'):
+                    time.sleep(0.01)
+        profiler.stop()
+
+        calls, wall, self_wall, cpu, self_cpu, peak = audit_profile.phases.get('search')
+        network = audit_profile.phases.get('network')
+        self.assertEqual((calls, network[0]), (1, 2))
+        self.assertGreaterEqual(network[1], 0.02)
+        self.assertAlmostEqual(self_wall, wall - network[1])
+        self.assertAlmostEqual(network[2], network[1])
+        self.assertGreaterEqual(wall, 0.04)
+        self.assertLess(cpu, wall)
+        self.assertGreaterEqual(audit_profile.wall, wall)
+
+    def test_phases_in_threads(self):
+        """Test phases are timed in every thread, each with its own nesting"""
+
+        audit_profile = profiler.start()
+        threads = [threading.Thread(target=_busy_worker, args=(1000,)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        profiler.stop()
+
+        calls, wall, self_wall = audit_profile.phases.get('filtering')[:3]
+        self.assertEqual(calls, 4)
+        self.assertAlmostEqual(self_wall, wall)
+
+    def test_inactive(self):
+        """Test phases do nothing when profiling is off"""
+
+        self.assertIsNone(profiler.stop())
+        with profiler.phase('search') as phase:
+            self.assertIs(phase, profiler._NULL_PHASE)
+
+    def test_report(self):
+        """Test the report lists phases by self time, and the files are written"""
+
+        audit_profile = profiler.start()
+        with profiler.phase('emission'):
+            time.sleep(0.001)
+        with profiler.phase('search'):
+            time.sleep(0.05)
+        self.assertIs(profiler.stop(), audit_profile)
+
+        report = audit_profile.report().splitlines()
+        self.assertTrue(report[0].startswith('Total: '))
+        self.assertEqual([line.split()[0] for line in report[3:5]], ['search', 'emission'])
+        with tempfile.TemporaryDirectory() as output_dir:
+            paths = audit_profile.write(output_dir)
+            self.assertEqual([os.path.basename(path) for path in paths],
+                             ['trello_watchman_profile.txt', 'trello_watchman_profile.collapsed'])
+            with open(paths[1]) as stacks_file:
+                stacks = stacks_file.read().splitlines()
+            self.assertTrue(stacks)
+            self.assertTrue(all(line.rsplit(' ', 1)[1].isdigit() for line in stacks))
+            self.assertTrue(any('test_report' in line for line in stacks))
+
+    def test_cprofile_threads(self):
+        """Test cProfile covers work done in worker threads, such as parallel searches"""
+
+        audit_profile = profiler.start(use_cprofile=True)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            list(executor.map(_busy_worker, [20000] * 4))
+        profiler.stop()
+
+        self.assertIn('_busy_worker', audit_profile.report())
+        with tempfile.TemporaryDirectory() as output_dir:
+            paths = audit_profile.write(output_dir)
+            self.assertEqual(os.path.basename(paths[-1]), 'trello_watchman_profile.pstats')
+            self.assertGreater(os.path.getsize(paths[-1]), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,14 @@
 import yaml
 import os
+import tempfile
+import threading
 import unittest
 from pathlib import Path
 
+import trello_watchman
 from trello_watchman import rule
 
-RULES_PATH = (Path(__file__).parent / 'rules').resolve()
+RULES_PATH = (Path(__file__).parent.parent / 'trello_watchman' / 'rules').resolve()
 
 
 def load_rules() -> list:
@@ -52,7 +55,10 @@ class TestEmail(unittest.TestCase):
         rules_list = load_rules()
         for rule in rules_list:
             for test_case in rule.test_cases.match_cases:
-                if not test_case == 'blank':
+                if rule.entropy:
+                    self.assertTrue(rule.search(test_case), msg=f'Entropy rule does not detect given match case: '
+                                                                f'{rule.filename}')
+                elif not test_case == 'blank':
                     self.assertRegex(test_case, rule.pattern, msg='Regex does not detect given match case')
 
     def test_rule_failing_cases(self):
@@ -61,11 +67,118 @@ class TestEmail(unittest.TestCase):
         rules_list = load_rules()
         for rule in rules_list:
             for test_case in rule.test_cases.fail_cases:
-                if not test_case == 'blank':
+                if rule.entropy:
+                    self.assertIsNone(rule.search(test_case), msg=f'Entropy rule does detect given failure case, it '
+                                                                  f'should not: {rule.filename}')
+                elif not test_case == 'blank':
                     self.assertNotRegex(test_case, rule.pattern,
                                         msg='Regex does detect given failure case, it should '
                                             'not')
 
+    def test_rule_anchors_match_cases(self):
+        """Test that the keyword prefilter lets every match case through to the regex. Skip if the match case
+        is 'blank'"""
+
+        rules_list = load_rules()
+        for rule in rules_list:
+            for test_case in rule.test_cases.match_cases:
+                if not test_case == 'blank':
+                    self.assertTrue(rule.may_match(test_case),
+                                    msg=f'Prefilter anchors {rule.anchors} skip given match case: {rule.filename}')
+
+    def test_extract_anchors(self):
+        """Test literal anchors are extracted from regex patterns"""
+
+        self.assertEqual(rule.extract_anchors('xox[baprs]-[0-9a-zA-Z]{10,48}'), ['xox'])
+        self.assertEqual(rule.extract_anchors('(?i)(refreshtoken|accesstoken)=\\S+'),
+                         ['accesstoken', 'refreshtoken'])
+        self.assertEqual(rule.extract_anchors('(-----BEGIN)?[0-9a-f]{32}'), [])
+        self.assertEqual(rule.extract_anchors('AIza[0-9A-Za-z]{35}|[0-9]+-[0-9A-Za-z_]{32}'), [])
+        self.assertEqual(rule.extract_anchors(''), [])
+
+    def test_rule_pattern_performance(self):
+        """Benchmark each rule's pattern against adversarial inputs. Fail if it backtracks catastrophically,
+        or if search time grows super-linearly with input size over every benchmark run"""
+
+        rules_list = load_rules()
+        benchmarks = rule.benchmark_patterns([definition.pattern for definition in rules_list])
+        for definition in rules_list:
+            benchmark = benchmarks.get(definition.pattern)
+            self.assertNotEqual(benchmark.verdict, 'catastrophic',
+                                msg=f'Regex did not finish searching {benchmark.worst_input}: {definition.filename}')
+            self.assertEqual(benchmark.verdict, 'linear',
+                             msg=f'Regex search time grows with input size to the power of {benchmark.exponent:.1f} '
+                                 f'on {benchmark.worst_input}: {definition.filename}')
+
+    def test_benchmark_pattern(self):
+        """Test the benchmark tells linear, super-linear and catastrophic patterns apart"""
+
+        self.assertEqual(rule.benchmark_pattern('xox[baprs]-[0-9a-zA-Z]{10,48}').verdict, 'linear')
+        self.assertEqual(rule.benchmark_pattern('\\d+\\d+x').verdict, 'super-linear')
+        self.assertEqual(rule.benchmark_pattern('(a+)+$', timeout=2).verdict, 'catastrophic')
+        for _ in range(3):
+            self.assertEqual(rule.benchmark_pattern('(?i)(secret|token|key|passw|pwd|credential|auth)').verdict,
+                             'linear')
+
+    def test_benchmark_cache(self):
+        """Test benchmark verdicts are reused from the cache, keyed by pattern"""
+
+        patterns = ['xox[baprs]-[0-9a-zA-Z]{10,48}', '\\d+\\d+x']
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache_path = os.path.join(cache_dir, 'benchmarks', 'rule_benchmarks.json')
+            benchmarks = rule.benchmark_patterns(patterns, cache_path)
+            self.assertTrue(all(benchmark.timings for benchmark in benchmarks.values()))
+            cached = rule.benchmark_patterns(patterns, cache_path)
+            for pattern in patterns:
+                self.assertEqual(cached.get(pattern).verdict, benchmarks.get(pattern).verdict)
+                self.assertEqual(cached.get(pattern).timings, {})
+            self.assertEqual(cached.get(patterns[1]).verdict, 'super-linear')
+
+    def test_guard_linear_patterns(self):
+        """Test only rules with a super-linear pattern keep the match timeout once benchmarked"""
+
+        rules_list = [rule.Rule('linear.yaml', True, None, ['text'], None, ['test'], 'xox[a-z]+', match_timeout=1),
+                      rule.Rule('quadratic.yaml', True, None, ['text'], None, ['test'], '\\d+\\d+x', match_timeout=1)]
+        checked = trello_watchman.benchmark_rules(rules_list)
+        self.assertEqual([definition.match_timeout for definition in checked], [None, 1])
+
+        definition = rule.load_from_yaml(RULES_PATH / 'tokens' / 'slack_api_tokens.yaml', 1, benchmark=True)
+        self.assertIsNone(definition.match_timeout)
+
+    def test_growth_exponent(self):
+        """Test growth is fitted over all measurable sizes, so one noisy timing doesn't make a pattern super-linear"""
+
+        linear = [(size, size * 1e-7) for size in (1024, 2048, 4096, 8192, 16384, 32768)]
+        self.assertAlmostEqual(rule._growth_exponent(linear), 1.0)
+        noisy = linear[:-1] + [(32768, 32768 * 1e-7 * 2.5)]
+        self.assertLess(rule._growth_exponent(noisy), rule.SUPER_LINEAR_EXPONENT)
+        quadratic = [(size, size ** 2 * 1e-10) for size in (1024, 2048, 4096, 8192, 16384)]
+        self.assertAlmostEqual(rule._growth_exponent(quadratic), 2.0)
+        self.assertTrue(rule._is_super_linear(quadratic))
+        # Too fast to tell apart from noise, however it grows
+        self.assertFalse(rule._is_super_linear([(size, size ** 2 * 1e-14) for size in (1024, 2048, 4096, 8192)]))
+
+    def test_match_timeout(self):
+        """Test a search exceeding the rule's match timeout is stopped"""
+
+        guarded = rule.Rule('test.yaml', True, None, ['text'], None, ['test'], '(a+)+$', match_timeout=0.5)
+        with self.assertRaises(rule.MatchTimeout):
+            guarded.search('a' * 50 + '!')
+
+        guarded = rule.Rule('test.yaml', True, None, ['text'], None, ['test'], 'xox[a-z]+', match_timeout=0.5)
+        self.assertEqual(guarded.search('token xoxbabc!').group(0), 'xoxbabc')
+        self.assertIsNone(guarded.search('no token'))
+
+    def test_thread_guards(self):
+        """Test each thread searches through its own regex worker"""
+
+        guards = []
+        thread = threading.Thread(target=lambda: guards.append(rule.thread_guard()))
+        thread.start()
+        thread.join()
+        self.assertIs(rule.thread_guard(), rule.thread_guard())
+        self.assertIsNot(guards[0], rule.thread_guard())
+
 
 if __name__ == '__main__':
     unittest.main()
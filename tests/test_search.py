@@ -0,0 +1,157 @@
+import unittest
+
+import trello_watchman
+from trello_watchman import logger
+from trello_watchman import models
+from trello_watchman import rule
+from trello_watchman import trello_wrapper
+
+
+class StubTrello(object):
+    """Stands in for the Trello API connection, returning boards from a dict of
+    boards by organization and recording the organizations looked up"""
+
+    def __init__(self, my_boards: list, organization_boards: dict, organization_ids: dict):
+        self.my_boards = my_boards
+        self.organization_boards = organization_boards
+        self.organization_ids = organization_ids
+        self.organizations_requested = []
+
+    def get_my_boards(self) -> list:
+        return [{'id': board_id} for board_id in self.my_boards]
+
+    def get_my_organizations(self) -> list:
+        return [{'id': organization_id} for organization_id in self.organization_ids.values()]
+
+    def get_organization(self, organization: str) -> dict:
+        self.organizations_requested.append(organization)
+        return {'id': self.organization_ids.get(organization, organization)}
+
+    def get_organization_boards(self, organization: str) -> list:
+        self.organizations_requested.append(organization)
+        organization_id = self.organization_ids.get(organization, organization)
+        return [{'id': board_id} for board_id in self.organization_boards.get(organization_id, [])]
+
+
+class TestScanTargets(unittest.TestCase):
+    def setUp(self):
+        self.trello = StubTrello(['b1', 'b2'],
+                                 {'o1': ['b2', 'b3'], 'o2': ['b4'], 'o3': []},
+                                 {'westeros': 'o1', 'essos': 'o2', 'braavos': 'o3'})
+
+    def test_resolve_boards(self):
+        """Test boards given are kept, and organizations given by name add their boards, each board once"""
+
+        self.assertEqual(trello_watchman.resolve_boards(self.trello, ['b9', 'b3'], ['westeros', 'o2']),
+                         ['b9', 'b3', 'b2', 'b4'])
+        self.assertEqual(self.trello.organizations_requested, ['westeros', 'o2'])
+        self.assertEqual(trello_watchman.resolve_boards(self.trello, None, ['braavos']), [])
+
+    def test_resolve_all_boards(self):
+        """Test the user's boards and the boards of their organizations are searched without filters"""
+
+        self.assertEqual(trello_watchman.resolve_boards(self.trello), ['b1', 'b2', 'b3', 'b4'])
+
+    def test_get_scan_targets(self):
+        """Test organizations are passed to Trello by ID unless boards are searched separately or also given"""
+
+        self.assertEqual(trello_watchman.get_scan_targets(self.trello, None, ['westeros', 'essos']),
+                         (None, ['o1', 'o2']))
+        self.assertEqual(trello_watchman.get_scan_targets(self.trello, ['b9'], ['essos']), (['b9', 'b4'], None))
+        self.assertEqual(trello_watchman.get_scan_targets(self.trello, None, ['essos'], workers=4), (['b4'], None))
+        self.assertEqual(trello_watchman.get_scan_targets(self.trello, ['b9']), (['b9'], None))
+        self.assertEqual(trello_watchman.get_scan_targets(self.trello), (None, None))
+
+
+class TestSearch(unittest.TestCase):
+    def setUp(self):
+        self.messages = []
+        output = logger.StdoutLogger()
+        output.log_info = self.messages.append
+        self.output_logger, trello_watchman.OUTPUT_LOGGER = trello_watchman.OUTPUT_LOGGER, output
+        self.find_text = trello_wrapper.find_text
+        self.calls = []
+        trello_wrapper.find_text = lambda trello, log_handler, rule_definition, tf, board_ids=None, \
+            organization_ids=None: self.calls.append((board_ids, organization_ids))
+        meta = type('meta', (), {'name': 'Slack API Tokens', 'severity': '90'})
+        self.rule = rule.Rule('slack_api_tokens.yaml', True, meta, ['text'], None, ['xox'], 'xox[a-z]+')
+
+    def tearDown(self):
+        trello_wrapper.find_text = self.find_text
+        trello_watchman.OUTPUT_LOGGER = self.output_logger
+
+    def test_no_boards(self):
+        """Test nothing is searched when the filters given resolve to no boards, rather than every board"""
+
+        trello_watchman.search(None, self.rule, 0, 'text', board_ids=[])
+        trello_watchman.search(None, self.rule, 0, 'text', board_ids=[], workers=4)
+        self.assertEqual(self.calls, [])
+        self.assertEqual(self.messages.count('No boards to search'), 2)
+
+    def test_parallel(self):
+        """Test each board is searched separately in parallel, and filters are passed on otherwise"""
+
+        trello_watchman.search(None, self.rule, 0, 'text', board_ids=['b1', 'b2', 'b3'], workers=2)
+        self.assertEqual(sorted(self.calls), [(['b1'], None), (['b2'], None), (['b3'], None)])
+        self.calls.clear()
+        trello_watchman.search(None, self.rule, 0, 'text', organization_ids=['o1'])
+        self.assertEqual(self.calls, [(None, ['o1'])])
+
+
+class StubStream(object):
+    """Stands in for the Trello API connection, streaming search results and
+    counting the cards decoded so far"""
+
+    def __init__(self, descriptions: list):
+        self.descriptions = descriptions
+        self.decoded = 0
+        self.boards = {'b1': models.Board('b1', 'Westeros Board', '', False, 'https://trello.com/b/1', ())}
+
+    def search_cards(self, query: str, board_ids: list = None, organization_ids: list = None):
+        for i, description in enumerate(self.descriptions):
+            self.decoded += 1
+            yield {'id': f'c{i}', 'name': 'Title', 'desc': description, 'url': f'https://trello.com/c/{i}',
+                   'idBoard': 'b1', 'dateLastActivity': '2021-03-09T00:00:00.000Z'}
+
+
+class TestFindText(unittest.TestCase):
+    def make_rule(self, pattern: str, entropy: dict = None) -> rule.Rule:
+        meta = type('meta', (), {'name': 'Test', 'severity': '90'})
+        return rule.Rule('test.yaml', True, meta, ['text'], None, ['test'], pattern, entropy=entropy)
+
+    def find_batches(self, definition: rule.Rule, descriptions: list) -> tuple:
+        """Run find_text, returning the number of cards decoded and matched at each match"""
+
+        trello = StubStream(descriptions)
+        batches = []
+        search_many = definition.search_many
+
+        def recording_search_many(texts):
+            if texts:
+                batches.append((trello.decoded, len(texts)))
+            return search_many(texts)
+
+        definition.search_many = recording_search_many
+        output = logger.StdoutLogger()
+        output.log_info = lambda message: None
+        return trello_wrapper.find_text(trello, output, definition), batches
+
+    def test_cards_streamed(self):
+        """Test rules without entropy match each card as soon as it is decoded"""
+
+        results, batches = self.find_batches(self.make_rule('xox[a-z]+'), ['token xoxbabc'] * 120)
+        self.assertEqual(len(results), 120)
+        self.assertEqual(batches, [(i, 1) for i in range(1, 121)])
+
+    def test_entropy_batches(self):
+        """Test entropy rules match small batches of cards, so the whole response isn't held in memory"""
+
+        results, batches = self.find_batches(self.make_rule('secret', entropy={'charset': 'base64'}),
+                                             ['secret = "hJ4kL9mN2pQ8rS5tU7vW1xY3zA6bC0dE"'] * 120)
+        self.assertEqual(len(results), 120)
+        batch = trello_wrapper.ENTROPY_BATCH
+        self.assertEqual(batches, [(batch, batch), (batch * 2, batch), (120, 120 - batch * 2)])
+
+
+if __name__ == '__main__':
+    unittest.main()
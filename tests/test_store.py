@@ -0,0 +1,96 @@
+import os
+import tempfile
+import unittest
+
+from trello_watchman import models
+from trello_watchman import store
+
+
+def make_result(card_id: str, match_string: str, board: models.Board) -> models.TextResult:
+    return models.TextResult(card_id, '2021-03-09T00:00:00.000Z', 'Title', f'key = {match_string}',
+                             'https://trello.com/c/1', match_string, board)
+
+
+class TestFindingsStore(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.temp_dir.name, store.DEFAULT_DB_NAME)
+        self.board = models.Board('b1', 'Westeros Board', '', False, 'https://trello.com/b/1',
+                                  (models.Member('m1', 'robertbaratheon'),))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_add_and_query(self):
+        """Test findings are written in batches and read back with filters"""
+
+        findings = store.FindingsStore(self.db_path, batch_size=2)
+        findings.add(make_result('c1', 'AKIA1', self.board), 'text', 'AWS Access Keys', '90')
+        findings.add(make_result('c2', 'xoxb-1', self.board), 'text', 'Slack API Tokens', '70')
+        self.assertEqual(findings.written, 2)
+        findings.add({'card_id': 'c3', 'match_string': 'AKIA2', 'board_id': 'b2'}, 'text', 'AWS Access Keys', '90')
+        findings.close()
+
+        findings = store.FindingsStore(self.db_path)
+        aws = list(findings.query(rules=['AWS Access Keys']))
+        self.assertEqual([finding.get('detection_data').get('card_id') for finding in aws], ['c3', 'c1'])
+        self.assertEqual(aws[1].get('detection_data').get('board_id'), 'b1')
+        self.assertEqual(aws[1].get('severity'), 90)
+        self.assertEqual(len(list(findings.query(severity=80, board_ids=['b1']))), 1)
+        self.assertEqual(len(list(findings.query(card_ids=['c2'], since='2000-01-01', before='2999-01-01'))), 1)
+        self.assertEqual(list(findings.query(before='2000-01-01')), [])
+        self.assertEqual(len(list(findings.query(limit=1))), 1)
+        self.assertEqual(findings.count('board_id'), [('Westeros Board (b1)', 2), ('b2', 1)])
+        self.assertEqual(findings.count('rule', severity=80), [('AWS Access Keys', 2)])
+        with self.assertRaises(Exception):
+            findings.count('data')
+        findings.close()
+
+    def test_repeated_findings(self):
+        """Test a finding seen in a later audit updates the existing row"""
+
+        for _ in range(2):
+            findings = store.FindingsStore(self.db_path)
+            findings.add(make_result('c1', 'AKIA1', self.board), 'text', 'AWS Access Keys', '90')
+            findings.close()
+
+        findings = store.FindingsStore(self.db_path)
+        self.assertEqual(findings.count('card_id'), [('c1', 1)])
+        findings.close()
+
+    def test_board_details(self):
+        """Test boards are stored once per batch, and again with their current details in the next batch"""
+
+        findings = store.FindingsStore(self.db_path)
+        for board_name in ('Westeros Board', 'Renamed Board'):
+            board = models.Board('b1', board_name, '', False, 'https://trello.com/b/1', self.board.members)
+            findings.add(make_result('c1', 'AKIA1', board), 'text', 'AWS Access Keys', '90')
+        findings.flush()
+        self.assertEqual(findings.count('board_id'), [('Westeros Board (b1)', 1)])
+
+        findings.add(make_result('c1', 'AKIA1', board), 'text', 'AWS Access Keys', '90')
+        findings.flush()
+        self.assertEqual(findings.count('board_id'), [('Renamed Board (b1)', 1)])
+        findings.close()
+
+    def test_repeated_findings_without_upsert(self):
+        """Test findings and boards are updated the same on SQLite versions without upserts"""
+
+        upsert, store.UPSERT = store.UPSERT, False
+        try:
+            for severity, board_name in (('70', 'Westeros Board'), ('90', 'Essos Board')):
+                findings = store.FindingsStore(self.db_path)
+                board = models.Board('b1', board_name, '', False, 'https://trello.com/b/1', self.board.members)
+                findings.add(make_result('c1', 'AKIA1', board), 'text', 'AWS Access Keys', severity)
+                findings.close()
+        finally:
+            store.UPSERT = upsert
+
+        findings = store.FindingsStore(self.db_path)
+        self.assertEqual(findings.count('board_id'), [('Essos Board (b1)', 1)])
+        self.assertEqual([finding.get('severity') for finding in findings.query()], [90])
+        findings.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
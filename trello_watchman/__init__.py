@@ -1,15 +1,25 @@
 import calendar
 import time
+import warnings
 import argparse
+import concurrent.futures
 import builtins
 import os
+import signal
+import sys
 import yaml
+import simplejson as json
 from pathlib import Path
 
 from trello_watchman import __about__
+from trello_watchman import cache
+from trello_watchman import daemon
 from trello_watchman import trello_wrapper
 from trello_watchman import logger
+from trello_watchman import profiler
 from trello_watchman import rule
+from trello_watchman import store
+from trello_watchman.rule import DEFAULT_MATCH_TIMEOUT
 
 DAY_TIMEFRAME = 86400
 MONTH_TIMEFRAME = 2592000
@@ -20,25 +30,78 @@ RULES_PATH = (Path(__file__).parent / 'rules').resolve()
 OUTPUT_LOGGER = ''
 
 
-def load_rules() -> list:
+def load_rules(match_timeout: float = None, benchmark: bool = False,
+               benchmark_cache: str = rule.DEFAULT_BENCHMARK_CACHE) -> list:
     """Load rules from YAML files
 
+    Args:
+        match_timeout: Seconds a single search with a rule's pattern may take, or None for no limit
+        benchmark: Whether to benchmark the rules' patterns. Rules whose pattern backtracks catastrophically
+            are left out, and only super-linear patterns are searched with the match timeout
+        benchmark_cache: JSON file benchmark verdicts are kept in between runs, or None to benchmark every run
     Returns:
         List containing loaded definitions as Rule objects
     """
 
     loaded_definitions = []
     try:
-        for root, dirs, files in os.walk(RULES_PATH):
-            for rule_file in files:
-                rule_path = (Path(root) / rule_file).resolve()
-                if rule_path.name.endswith('.yaml'):
-                    loaded_definitions.append(rule.load_from_yaml(rule_path))
+        with profiler.phase('rule loading'):
+            for root, dirs, files in os.walk(RULES_PATH):
+                for rule_file in files:
+                    rule_path = (Path(root) / rule_file).resolve()
+                    if rule_path.name.endswith('.yaml'):
+                        loaded_definitions.append(rule.load_from_yaml(rule_path, match_timeout))
+            if benchmark:
+                loaded_definitions = benchmark_rules(loaded_definitions, benchmark_cache)
         return loaded_definitions
     except Exception as e:
         raise e
 
 
+def benchmark_rules(rules_list: list, benchmark_cache: str = None) -> list:
+    """Benchmark the patterns of loaded rules. Rules with a linear pattern are
+    searched directly, without the match timeout, as they can't hang an audit
+
+    Args:
+        rules_list: List of Rule objects
+        benchmark_cache: JSON file benchmark verdicts are kept in between runs, or None to benchmark every run
+    Returns:
+        List of the rules that don't backtrack catastrophically
+    """
+
+    results = rule.benchmark_patterns([definition.pattern for definition in rules_list], benchmark_cache)
+    checked = []
+    for definition in rules_list:
+        result = results.get(definition.pattern)
+        if result.verdict == 'catastrophic':
+            warnings.warn(f'Rule {definition.filename} skipped: pattern did not finish searching '
+                          f'{result.worst_input} within {rule.BENCHMARK_TIMEOUT}s')
+            continue
+        if result.verdict == 'linear':
+            definition.match_timeout = None
+        checked.append(definition)
+    return checked
+
+
+def get_timeframe(tm: str) -> int:
+    """Convert a timeframe choice to the number of seconds to search back
+
+    Args:
+        tm: Timeframe choice, d, w, m or a
+    Returns:
+        Timeframe in seconds
+    """
+
+    if tm == 'd':
+        return DAY_TIMEFRAME
+    elif tm == 'w':
+        return WEEK_TIMEFRAME
+    elif tm == 'm':
+        return MONTH_TIMEFRAME
+    else:
+        return ALL_TIME
+
+
 def validate_conf(path: str) -> bool or list:
     """Check the file watchman.conf exists
 
@@ -56,7 +119,111 @@ def validate_conf(path: str) -> bool or list:
             return yaml.safe_load(yaml_file).get('trello_watchman')
 
 
-def search(trello_conn: trello_wrapper.TrelloAPI, rule: rule.Rule, tf: int, scope: str):
+def get_db_path(conf_path: str) -> str:
+    """Get the path of the findings database, from the TRELLO_WATCHMAN_DB_PATH
+    environment variable or the watchman.conf file, defaulting to the home directory
+
+    Args:
+        conf_path: Path of the watchman.conf file
+    Returns:
+        Path of the SQLite database file
+    """
+
+    path = os.environ.get('TRELLO_WATCHMAN_DB_PATH')
+    if not path and os.path.exists(conf_path):
+        with open(conf_path) as yaml_file:
+            config = yaml.safe_load(yaml_file).get('trello_watchman') or {}
+        path = ((config.get('logging') or {}).get('sqlite') or {}).get('path')
+    path = os.path.expanduser(path or '~')
+    if os.path.isdir(path):
+        path = os.path.join(path, store.DEFAULT_DB_NAME)
+    return path
+
+
+def log_results(results: list, scope: str, rule: rule.Rule, compact: bool, logged_boards: set = None):
+    """Send results to the output logger. In compact mode each board is logged
+    once per run, and results reference their board by ID
+
+    Args:
+        results: List of result objects to log
+        scope: Scope the results were found in
+        rule: Rule object the results were found by
+        compact: Whether to log boards once and results by reference
+        logged_boards: IDs of the boards already logged in this run, which boards
+            logged are added to. Without it, boards are logged once for these results
+    """
+
+    if logged_boards is None:
+        logged_boards = set()
+    with profiler.phase('emission'):
+        for result in results:
+            if compact:
+                if result.board.id not in logged_boards:
+                    logged_boards.add(result.board.id)
+                    OUTPUT_LOGGER.log_board(result.board)
+                log_data = result.as_reference()
+            else:
+                log_data = result
+            OUTPUT_LOGGER.log_notification(log_data, scope, rule.meta.name, rule.meta.severity)
+
+
+def resolve_boards(trello_conn: trello_wrapper.TrelloAPI, board_ids: list = None, organizations: list = None) -> list:
+    """Get the IDs of the boards to search, from the boards and organizations given.
+    If neither are given, these are the boards the user of the OAuth token is a
+    member of and the boards they can see in their organizations, as a search
+    without filters would cover
+
+    Args:
+        trello_conn: Trello API connection object
+        board_ids: IDs of boards to search
+        organizations: IDs or names of organizations to search the boards of
+    Returns:
+        List of unique board IDs
+    """
+
+    boards = list(board_ids or [])
+    for organization in organizations or []:
+        boards.extend(board.get('id') for board in trello_conn.get_organization_boards(organization))
+    if not board_ids and not organizations:
+        boards.extend(board.get('id') for board in trello_conn.get_my_boards())
+        for organization in trello_conn.get_my_organizations():
+            boards.extend(board.get('id') for board in trello_conn.get_organization_boards(organization.get('id')))
+    return list(dict.fromkeys(boards))
+
+
+def get_scan_targets(trello_conn: trello_wrapper.TrelloAPI,
+                     board_ids: list = None,
+                     organizations: list = None,
+                     workers: int = 0) -> tuple:
+    """Get the boards or organizations to restrict searches to. Boards are
+    resolved to a list of IDs when searching in parallel or when both boards
+    and organizations are given, otherwise organizations are passed to Trello
+
+    Args:
+        trello_conn: Trello API connection object
+        board_ids: IDs of boards to search
+        organizations: IDs or names of organizations to search the boards of
+        workers: Number of boards to search in parallel
+    Returns:
+        Tuple of board IDs and organization IDs, either of which may be None
+    """
+
+    if workers or (board_ids and organizations):
+        return resolve_boards(trello_conn, board_ids, organizations), None
+    elif organizations:
+        return board_ids, [trello_conn.get_organization(organization).get('id') for organization in organizations]
+    return board_ids, None
+
+
+def search(trello_conn: trello_wrapper.TrelloAPI,
+           rule: rule.Rule,
+           tf: int,
+           scope: str,
+           compact: bool = False,
+           board_ids: list = None,
+           organization_ids: list = None,
+           workers: int = 0,
+           logged_boards: set = None):
     """Carries out a search on the Trello API based on the given rule,
      timeframe and scope
 
@@ -65,6 +232,13 @@ def search(trello_conn: trello_wrapper.TrelloAPI, rule: rule.Rule, tf: int, scop
             rule: Rule object to use for the search
             tf: Epoch timeframe to search back in
             scope: What to search Trello for
+            compact: Whether to log boards once and results by reference
+            board_ids: IDs of the boards to restrict the search to
+            organization_ids: IDs of the organizations to restrict the search to
+            workers: Number of boards to search in parallel. If more than 0, each
+                board in board_ids is searched separately. An empty board_ids list
+                means no boards to search, not all boards
+            logged_boards: IDs of the boards already logged in this run with compact
         """
 
     if isinstance(OUTPUT_LOGGER, logger.StdoutLogger):
@@ -74,23 +248,136 @@ def search(trello_conn: trello_wrapper.TrelloAPI, rule: rule.Rule, tf: int, scop
 
     if scope == 'attachments':
         print(f'Searching for attachments containing {rule.meta.name}')
-        attachments = trello_wrapper.find_attachments(trello_conn, OUTPUT_LOGGER, rule, tf)
-        if attachments:
-            for log_data in attachments:
-                OUTPUT_LOGGER.log_notification(log_data, scope, rule.meta.name,
-                                               rule.meta.severity)
-    if scope == 'text':
+        find = trello_wrapper.find_attachments
+    elif scope == 'text':
         print(f'Searching for cards containing {rule.meta.name}')
-        text = trello_wrapper.find_text(trello_conn, OUTPUT_LOGGER, rule, tf)
-        if text:
-            for log_data in text:
-                OUTPUT_LOGGER.log_notification(log_data, scope, rule.meta.name,
-                                               rule.meta.severity)
+        find = trello_wrapper.find_text
+    else:
+        return
+
+    # Boards were resolved from the filters given, but none were found. Searching
+    # without idBoards would widen the search to every board the token can see
+    if board_ids is not None and not board_ids:
+        print('No boards to search')
+        return
+
+    with profiler.phase('search'):
+        if workers and board_ids:
+            results = []
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(find, trello_conn, OUTPUT_LOGGER, rule, tf, [board_id])
+                           for board_id in board_ids]
+                for future in concurrent.futures.as_completed(futures):
+                    results.extend(future.result() or [])
+        else:
+            results = find(trello_conn, OUTPUT_LOGGER, rule, tf, board_ids, organization_ids)
+    if results:
+        log_results(results, scope, rule, compact, logged_boards)
+
+
+def run_job(trello_conn: trello_wrapper.TrelloAPI,
+            rules_list: list,
+            job: daemon.Job,
+            compact: bool = False,
+            board_ids: list = None,
+            organizations: list = None,
+            workers: int = 0):
+    """Run a daemon job, searching with each of the job's rules. Each search looks
+    back to shortly before the job's last successful run started, so findings
+    aren't output again by every run. The run fetches and logs boards and members
+    on its own, so results have up to date board metadata, without affecting
+    other jobs running at the same time
+
+    Args:
+        trello_conn: Trello API connection object shared by all jobs, which the run gets its own copy of
+        rules_list: List of all loaded Rule objects
+        job: Job object to run
+        compact: Whether to log boards once per run and results by reference
+        board_ids: IDs of boards to search
+        organizations: IDs or names of organizations to search the boards of
+        workers: Number of boards to search in parallel
+    """
+
+    trello_conn = trello_conn.for_run()
+    logged_boards = set()
+    started = time.time()
+    first_run = get_timeframe(job.timeframe) if job.timeframe else None
+    board_ids, organization_ids = get_scan_targets(trello_conn, board_ids, organizations, workers)
+    for rule_definition in rules_list:
+        if job.selects(rule_definition):
+            for scope in job.scopes:
+                if scope in rule_definition.scope:
+                    tf = job.search_back(time.time(), first_run)
+                    search(trello_conn, rule_definition, tf, scope, compact, board_ids, organization_ids, workers,
+                           logged_boards)
+    if isinstance(OUTPUT_LOGGER, logger.SQLiteLogger):
+        OUTPUT_LOGGER.store.flush()
+    job.last_started = started
+
+
+def query(argv: list):
+    """Query findings stored by the sqlite output, printing them as JSON lines
+    or as counts
+
+    Args:
+        argv: Command line arguments following 'query'
+    """
+
+    conf_path = f'{os.path.expanduser("~")}/watchman.conf'
+    parser = argparse.ArgumentParser(prog='trello-watchman query',
+                                     description='Query findings stored with --output sqlite')
+    parser.add_argument('--db', dest='db_path', default=None,
+                        help='Findings database, default from TRELLO_WATCHMAN_DB_PATH, watchman.conf '
+                             f'or ~/{store.DEFAULT_DB_NAME}')
+    parser.add_argument('--rule', dest='rules', action='append',
+                        help='Only findings of this rule, by name. Can be given more than once')
+    parser.add_argument('--severity', dest='severity', type=int,
+                        help='Only findings of at least this severity')
+    parser.add_argument('--board', dest='board_ids', action='append', metavar='BOARD_ID',
+                        help='Only findings on this board. Can be given more than once')
+    parser.add_argument('--card', dest='card_ids', action='append', metavar='CARD_ID',
+                        help='Only findings on this card. Can be given more than once')
+    parser.add_argument('--since', dest='since',
+                        help='Only findings first seen at or after this time, YYYY-MM-DD[ HH:MM:SS]')
+    parser.add_argument('--before', dest='before',
+                        help='Only findings first seen before this time, YYYY-MM-DD[ HH:MM:SS]')
+    parser.add_argument('--count-by', dest='group_by', choices=['rule', 'severity', 'board', 'card', 'scope'],
+                        help='Print the number of findings for each rule, severity, board, card or scope instead')
+    parser.add_argument('--limit', dest='limit', type=int,
+                        help='Maximum number of findings, or counts, to print')
+
+    args = parser.parse_args(argv)
+    db_path = args.db_path or get_db_path(conf_path)
+    if not os.path.exists(db_path):
+        parser.error(f'No findings database at {db_path}')
+
+    findings = store.FindingsStore(db_path)
+    filters = {
+        'rules': args.rules,
+        'severity': args.severity,
+        'board_ids': args.board_ids,
+        'card_ids': args.card_ids,
+        'since': args.since,
+        'before': args.before
+    }
+    try:
+        if args.group_by:
+            group_by = {'board': 'board_id', 'card': 'card_id'}.get(args.group_by, args.group_by)
+            for value, count in findings.count(group_by, args.limit, **filters):
+                print(f'{count}\t{value}')
+        else:
+            for finding in findings.query(args.limit, **filters):
+                print(json.dumps(finding))
+    finally:
+        findings.close()
 
 
 def main():
     global OUTPUT_LOGGER
 
+    if sys.argv[1:2] == ['query']:
+        return query(sys.argv[2:])
+
     if isinstance(OUTPUT_LOGGER, logger.StdoutLogger):
         print = OUTPUT_LOGGER.log_critical
     else:
@@ -100,9 +387,9 @@ def main():
         parser = argparse.ArgumentParser(description=__about__.__summary__)
         required = parser.add_argument_group('required arguments')
         required.add_argument('--timeframe', choices=['d', 'w', 'm', 'a'], dest='time',
-                              help='How far back to search: d = 24 hours w = 7 days, m = 30 days, a = all time',
-                              required=True)
-        required.add_argument('--output', choices=['file', 'stdout', 'stream'], dest='logging_type',
+                              help='How far back to search: d = 24 hours w = 7 days, m = 30 days, a = all time. '
+                                   'Not used with --daemon')
+        required.add_argument('--output', choices=['file', 'stdout', 'stream', 'sqlite'], dest='logging_type',
                               help='Where to send results')
         parser.add_argument('--version', action='version',
                             version=f'trello-watchman {__about__.__version__}')
@@ -112,22 +399,51 @@ def main():
                             help='Search for attachments')
         parser.add_argument('--text', dest='text', action='store_true',
                             help='Search text')
+        parser.add_argument('--compact', dest='compact', action='store_true',
+                            help='Log board metadata once per run and reference boards by ID in results')
+        parser.add_argument('--no-cache', dest='no_cache', action='store_true',
+                            help='Do not cache Trello API responses between runs')
+        parser.add_argument('--cache-dir', dest='cache_dir', default=cache.DEFAULT_CACHE_DIR,
+                            help=f'Directory to cache Trello API responses in, default {cache.DEFAULT_CACHE_DIR}')
+        parser.add_argument('--board', dest='board_ids', action='append', metavar='BOARD_ID',
+                            help='Only search this board. Can be given more than once')
+        parser.add_argument('--org', dest='organizations', action='append', metavar='ORG',
+                            help='Only search boards in this organization, by ID or name. Can be given more than once')
+        parser.add_argument('--parallel', dest='workers', type=int, default=0, metavar='WORKERS',
+                            help=f'Search each board separately, with up to this many boards searched in parallel. '
+                                 f'Max {trello_wrapper.MAX_WORKERS}')
+        parser.add_argument('--daemon', dest='daemon', action='store_true',
+                            help='Keep running, searching with the jobs configured in watchman.conf at their '
+                                 'intervals')
+        parser.add_argument('--regex-timeout', dest='regex_timeout', type=float, default=DEFAULT_MATCH_TIMEOUT,
+                            help=f'Seconds a super-linear rule pattern may take to search a card before the rule is '
+                                 f'skipped, 0 for no limit. Default {DEFAULT_MATCH_TIMEOUT}')
+        parser.add_argument('--profile', dest='profile', nargs='*', choices=['cprofile', 'tracemalloc'],
+                            help='Profile the audit and write a report next to the log output. Optionally also run '
+                                 'cProfile and/or tracemalloc')
 
         args = parser.parse_args()
+        if not args.time and not args.daemon:
+            parser.error('the following arguments are required: --timeframe')
         tm = args.time
         everything = args.everything
         attachments = args.attachments
         text = args.text
         logging_type = args.logging_type
+        compact = args.compact
+        no_cache = args.no_cache
+        cache_dir = args.cache_dir
+        profile = args.profile
+        match_timeout = args.regex_timeout or None
+        board_ids = args.board_ids
+        organizations = args.organizations
+        workers = min(max(args.workers, 0), trello_wrapper.MAX_WORKERS)
+        daemon_mode = args.daemon
 
-        if tm == 'd':
-            tf = DAY_TIMEFRAME
-        elif tm == 'w':
-            tf = WEEK_TIMEFRAME
-        elif tm == 'm':
-            tf = MONTH_TIMEFRAME
-        else:
-            tf = ALL_TIME
+        if profile is not None:
+            profiler.start(use_cprofile='cprofile' in profile, use_tracemalloc='tracemalloc' in profile)
+
+        tf = get_timeframe(tm)
 
         conf_path = f'{os.path.expanduser("~")}/watchman.conf'
 
@@ -137,7 +453,17 @@ def main():
                             f'home directory: {os.path.expanduser("~")}')
         else:
             config = validate_conf(conf_path)
-            connection = trello_wrapper.initiate_trello_connection()
+            if no_cache:
+                response_cache = None
+            else:
+                response_cache = cache.ResponseCache(cache_dir)
+            # Sequential requests rarely reach Trello's limit, and a 429 is retried after a
+            # cool off, but parallel searches and concurrent jobs share one budget to stay within it
+            if daemon_mode or workers:
+                rate_limiter = trello_wrapper.RateLimiter()
+            else:
+                rate_limiter = None
+            connection = trello_wrapper.initiate_trello_connection(response_cache, rate_limiter)
 
         if logging_type:
             if logging_type == 'file':
@@ -161,6 +487,8 @@ def main():
                                                             config.get('logging').get('json_tcp').get('port'))
                 else:
                     raise Exception("JSON TCP stream selected with no config")
+            elif logging_type == 'sqlite':
+                OUTPUT_LOGGER = logger.SQLiteLogger(get_db_path(conf_path))
         else:
             print('No logging option selected, defaulting to stdout')
             OUTPUT_LOGGER = logger.StdoutLogger()
@@ -170,34 +498,69 @@ def main():
             print('Trello Watchman')
             print(f'Version: {__about__.__version__}\n')
             print('Importing rules...')
-            rules_list = load_rules()
+            rules_list = load_rules(match_timeout, benchmark=True)
             print(f'{len(rules_list)} rules loaded')
         else:
             OUTPUT_LOGGER.log_info(f'Trello Watchman started execution - Version: {__about__.__version__}')
             OUTPUT_LOGGER.log_info('Importing rules...')
-            rules_list = load_rules()
+            rules_list = load_rules(match_timeout, benchmark=True)
             OUTPUT_LOGGER.log_info(f'{len(rules_list)} rules loaded')
             print = OUTPUT_LOGGER.log_info
 
-        if everything:
-            print('Getting everything...')
-            for rule in rules_list:
-                if 'attachments' in rule.scope:
-                    search(connection, rule, tf, 'attachments')
-                if 'text' in rule.scope:
-                    search(connection, rule, tf, 'text')
+        if daemon_mode:
+            jobs = daemon.load_jobs(conf_path)
+            scheduler = daemon.Scheduler(
+                jobs, lambda job: run_job(connection, rules_list, job, compact, board_ids, organizations, workers),
+                print)
+            signal.signal(signal.SIGTERM, lambda signum, frame: scheduler.stop())
+            for job in jobs:
+                print(f'Job {job.name}: {", ".join(job.rules)} rules every {job.interval}s'
+                      + (f', first run timeframe {job.timeframe}' if job.timeframe else ''))
+            try:
+                scheduler.run()
+            except KeyboardInterrupt:
+                scheduler.stop()
+            print('Daemon stopped, ' + ', '.join(f'{name} ran {runs} times' for name, runs in scheduler.runs.items()))
+
         else:
-            if attachments:
-                print('Getting attachments')
+            board_ids, organization_ids = get_scan_targets(connection, board_ids, organizations, workers)
+            logged_boards = set()
+            if board_ids is not None and not board_ids:
+                print('No boards found to search')
+            elif board_ids and (workers or organizations):
+                print(f'Searching {len(board_ids)} boards' + (f', {workers} in parallel' if workers else ''))
+
+            if everything:
+                print('Getting everything...')
                 for rule in rules_list:
                     if 'attachments' in rule.scope:
-                        search(connection, rule, tf, 'attachments')
-            if text:
-                print('Getting cards')
-                for rule in rules_list:
+                        search(connection, rule, tf, 'attachments', compact, board_ids, organization_ids, workers,
+                               logged_boards)
                     if 'text' in rule.scope:
-                        search(connection, rule, tf, 'text')
-
+                        search(connection, rule, tf, 'text', compact, board_ids, organization_ids, workers,
+                               logged_boards)
+            else:
+                if attachments:
+                    print('Getting attachments')
+                    for rule in rules_list:
+                        if 'attachments' in rule.scope:
+                            search(connection, rule, tf, 'attachments', compact, board_ids, organization_ids, workers,
+                                   logged_boards)
+                if text:
+                    print('Getting cards')
+                    for rule in rules_list:
+                        if 'text' in rule.scope:
+                            search(connection, rule, tf, 'text', compact, board_ids, organization_ids, workers,
+                                   logged_boards)
+
+        if isinstance(OUTPUT_LOGGER, logger.SQLiteLogger):
+            OUTPUT_LOGGER.store.flush()
+            print(f'{OUTPUT_LOGGER.store.written} findings written to {OUTPUT_LOGGER.db_path}')
+        print(f'{connection.requests_made} requests made to Trello, {connection.bytes_received} bytes received')
+        if connection.rate_limiter and connection.rate_limiter.waited:
+            print(f'{connection.rate_limiter.waited:.1f}s spent waiting on the Trello rate limit')
+        if connection.cache:
+            print(f'{connection.cache.hits} responses served from cache, {connection.cache.misses} fetched from Trello')
         print('++++++Audit completed++++++')
 
     except Exception as e:
@@ -208,6 +571,14 @@ def main():
 
         print(e)
 
+    finally:
+        if isinstance(OUTPUT_LOGGER, logger.SQLiteLogger):
+            OUTPUT_LOGGER.close()
+        audit_profile = profiler.stop()
+        if audit_profile:
+            profile_paths = audit_profile.write(getattr(OUTPUT_LOGGER, 'log_path', '') or os.path.expanduser('~'))
+            print(f'Profile written to {", ".join(profile_paths)}')
+
 
 if __name__ == '__main__':
     main()
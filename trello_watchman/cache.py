@@ -0,0 +1,181 @@
+import hashlib
+import os
+import threading
+import time
+import requests
+import simplejson as json
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.trello_watchman', 'cache')
+DEFAULT_TTL = 300
+DEFAULT_MAX_SIZE = 100 * 1024 * 1024
+
+
+class ResponseCache(object):
+    """On-disk cache of Trello API responses, kept between runs
+
+    Cached responses include card text and comments, so may contain the
+    secrets an audit finds. The cache directory is created readable by the
+    owner only, and entries are written with mode 0600.
+
+    Responses that came with an ETag or Last-Modified header are revalidated
+    with a conditional request every time they are used, so only a 304 with
+    no body is transferred when nothing has changed. Responses without
+    validators are reused without a request until they are older than the TTL.
+    When the cache grows past its maximum size, the least recently used
+    entries are removed.
+
+    Attributes:
+        cache_dir: Directory the cache entries are stored in
+        ttl: Seconds a response without validators is reused for
+        max_size: Maximum total size of the cache entries in bytes
+        hits: Number of responses served from the cache
+        misses: Number of responses fetched in full from Trello
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, ttl: int = DEFAULT_TTL, max_size: int = DEFAULT_MAX_SIZE):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        self._size = 0
+        for entry in self._entries():
+            # Entries written by earlier versions were readable by all users
+            try:
+                os.chmod(entry.path, 0o600)
+            except OSError:
+                pass
+            self._size += entry.stat().st_size
+
+    def _entries(self) -> list:
+        return [entry for entry in os.scandir(self.cache_dir) if entry.name.endswith('.json')]
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f'{key}.json')
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """Create a cache key from the parts of a request
+
+        Args:
+            parts: JSON serialisable parts that identify the request,
+                e.g. URL, params and credentials
+        Returns:
+            Hex digest to use as the cache key
+        """
+
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> dict or None:
+        """Get a cache entry
+
+        Args:
+            key: Cache key of the request
+        Returns:
+            Dict with the stored response and its validators, or None if not cached
+        """
+
+        try:
+            with open(self._path(key)) as entry_file:
+                return json.load(entry_file)
+        except (OSError, ValueError):
+            return None
+
+    def is_fresh(self, entry: dict) -> bool:
+        """Check whether an entry without validators can be used without a request
+
+        Args:
+            entry: Cache entry
+        Returns:
+            True if the entry has no validators and is younger than the TTL
+        """
+
+        return not (entry.get('etag') or entry.get('last_modified')) and time.time() - entry.get('stored') < self.ttl
+
+    @staticmethod
+    def conditional_headers(entry: dict) -> dict:
+        """Build the headers to revalidate a cache entry with Trello
+
+        Args:
+            entry: Cache entry
+        Returns:
+            Dict of If-None-Match/If-Modified-Since headers
+        """
+
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry.get('etag')
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry.get('last_modified')
+        return headers
+
+    def hit(self, key: str, entry: dict) -> requests.Response:
+        """Record a cache hit and build a response from the entry
+
+        Args:
+            key: Cache key of the request
+            entry: Cache entry
+        Returns:
+            Response object with the cached content
+        """
+
+        with self._lock:
+            self.hits += 1
+        try:
+            os.utime(self._path(key))
+        except OSError:
+            pass
+        response = requests.Response()
+        response.status_code = 200
+        response.url = entry.get('url')
+        response.encoding = 'utf-8'
+        response._content = entry.get('content').encode('utf-8')
+        return response
+
+    def put(self, key: str, response: requests.Response):
+        """Store a response in the cache, evicting old entries if the
+        cache is over its maximum size
+
+        Args:
+            key: Cache key of the request
+            response: Successful response from Trello
+        """
+
+        path = self._path(key)
+        entry = json.dumps({
+            'url': response.url,
+            'stored': time.time(),
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'content': response.text
+        })
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with self._lock:
+            self.misses += 1
+            try:
+                self._size -= os.path.getsize(path)
+            except OSError:
+                pass
+            with os.fdopen(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as entry_file:
+                entry_file.write(entry)
+            os.replace(temp_path, path)
+            self._size += os.path.getsize(path)
+            if self._size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        """Remove the least recently used entries until the cache is
+        at most 90% of its maximum size"""
+
+        entries = sorted(self._entries(), key=lambda entry: entry.stat().st_mtime)
+        for entry in entries:
+            if self._size <= self.max_size * 0.9:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                self._size -= size
+            except OSError:
+                pass
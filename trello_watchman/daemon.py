@@ -0,0 +1,202 @@
+import builtins
+import concurrent.futures
+import heapq
+import os
+import re
+import threading
+import time
+import yaml
+
+# Jobs run when watchman.conf doesn't define any: token rules hourly, PII daily, files weekly
+DEFAULT_JOBS = [
+    {'name': 'tokens', 'rules': ['tokens'], 'every': '1h'},
+    {'name': 'pii', 'rules': ['pii'], 'every': '1d'},
+    {'name': 'files', 'rules': ['files'], 'every': '1w'},
+]
+
+INTERVAL_UNITS = {
+    's': 1,
+    'm': 60,
+    'h': 3600,
+    'd': 86400,
+    'w': 604800,
+}
+
+SCOPES = ['text', 'attachments']
+
+# Each run searches back to this many seconds before the previous run started, so cards
+# active while a search request was being made, or timed by a clock ahead of Trello's, aren't missed
+RUN_OVERLAP = 60
+
+
+def parse_interval(interval) -> int:
+    """Convert an interval such as '30m', '6h' or '1w' to seconds. Numbers
+    without a unit are taken as seconds
+
+    Args:
+        interval: Interval string or number of seconds
+    Returns:
+        Interval in seconds
+    """
+
+    match = re.fullmatch(r'\s*(\d+)\s*([smhdw]?)\s*', str(interval))
+    if not match or int(match.group(1)) == 0:
+        raise Exception(f'Invalid job interval {interval!r}, expected a number followed by one of s, m, h, d, w')
+    return int(match.group(1)) * INTERVAL_UNITS.get(match.group(2) or 's')
+
+
+class Job(object):
+    """A set of rules run by the daemon at a fixed interval
+
+    Attributes:
+        name: Name of the job, used in log messages
+        rules: Rule categories (the directory the rule is in, e.g. tokens,
+            pii, files) or rule filenames the job runs
+        scopes: Scopes the job searches, text and/or attachments
+        interval: Seconds between the start of each run
+        timeframe: How far back the first run searches, d, w, m or a, or None
+            to search back one interval
+        last_started: Epoch time the last successful run started, or None
+    """
+
+    def __init__(self, name: str, rules: list, interval: int, scopes: list = None, timeframe: str = None):
+        self.name = name
+        self.rules = rules
+        self.interval = interval
+        self.scopes = scopes or SCOPES
+        self.timeframe = timeframe
+        self.last_started = None
+        if self.timeframe not in (None, 'd', 'w', 'm', 'a'):
+            raise Exception(f'Invalid timeframe {self.timeframe!r} for job {name}, must be one of d, w, m, a')
+        if set(self.scopes) - set(SCOPES):
+            raise Exception(f'Invalid scope for job {name}, must be text and/or attachments')
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.__dict__!r})'
+
+    def selects(self, rule) -> bool:
+        """Check whether the job runs a rule
+
+        Args:
+            rule: Rule object
+        Returns:
+            True if the rule's category or filename is one of the job's rules
+        """
+
+        return rule.category in self.rules or os.path.splitext(rule.filename or '')[0] in self.rules
+
+    def search_back(self, now: float, first_run: int = None) -> int:
+        """Get how many seconds a search made now looks back. Once the job has run,
+        this is to shortly before its last successful run started, so later runs
+        only find cards active since then
+
+        Args:
+            now: Epoch time of the search
+            first_run: Seconds the first run looks back, by default one interval
+        Returns:
+            Seconds to search back
+        """
+
+        if self.last_started is None:
+            return first_run or self.interval + RUN_OVERLAP
+        return int(now - self.last_started) + RUN_OVERLAP
+
+
+def load_jobs(conf_path: str) -> list:
+    """Load daemon jobs from the daemon section of the watchman.conf file,
+    or the default jobs if none are configured
+
+    Args:
+        conf_path: Path of the watchman.conf file
+    Returns:
+        List of Job objects
+    """
+
+    job_definitions = None
+    if os.path.exists(conf_path):
+        with open(conf_path) as yaml_file:
+            config = yaml.safe_load(yaml_file).get('trello_watchman') or {}
+        job_definitions = (config.get('daemon') or {}).get('jobs')
+
+    jobs = []
+    for definition in job_definitions or DEFAULT_JOBS:
+        rules = definition.get('rules')
+        jobs.append(Job(name=definition.get('name') or ','.join(rules),
+                        rules=[rules] if isinstance(rules, str) else rules,
+                        interval=parse_interval(definition.get('every')),
+                        scopes=definition.get('scope'),
+                        timeframe=definition.get('timeframe')))
+    return jobs
+
+
+class Scheduler(object):
+    """Runs jobs at their intervals in one long-lived process
+
+    Jobs are kept in a heap ordered by when they are next due. Each job runs
+    on its own thread, so a long job doesn't hold up jobs due in the meantime,
+    but a job never overlaps with its own previous run: if a run is still going
+    when the job is next due, that run is skipped. Runs stay on each job's
+    interval, and runs missed while a job was busy are not made up.
+
+    Attributes:
+        jobs: List of Job objects
+        run_job: Function called with a Job object to run it
+        runs: Number of completed runs by job name
+        skipped: Number of skipped runs by job name
+    """
+
+    def __init__(self, jobs: list, run_job, output=builtins.print):
+        self.jobs = jobs
+        self.run_job = run_job
+        self.output = output
+        self.runs = {job.name: 0 for job in jobs}
+        self.skipped = {job.name: 0 for job in jobs}
+        self._running = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._queue = []
+
+    def stop(self):
+        """Stop scheduling new runs. Runs already started are finished"""
+
+        self._stopped.set()
+
+    def run(self):
+        """Run all jobs now, then at their intervals, until stopped"""
+
+        if not self.jobs:
+            return
+        now = time.monotonic()
+        self._queue = [(now, position, job) for position, job in enumerate(self.jobs)]
+        heapq.heapify(self._queue)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(self.jobs),
+                                                   thread_name_prefix='job') as executor:
+            while not self._stopped.is_set():
+                due, position, job = self._queue[0]
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self._stopped.wait(delay)
+                    continue
+
+                missed = int((time.monotonic() - due) // job.interval)
+                heapq.heapreplace(self._queue, (due + (missed + 1) * job.interval, position, job))
+                with self._lock:
+                    if job in self._running:
+                        self.skipped[job.name] += 1
+                        self.output(f'Job {job.name} skipped, its previous run is still going')
+                        continue
+                    self._running.add(job)
+                executor.submit(self._run, job)
+
+    def _run(self, job: Job):
+        started = time.monotonic()
+        self.output(f'Job {job.name} started')
+        try:
+            self.run_job(job)
+            self.output(f'Job {job.name} finished in {time.monotonic() - started:.1f}s')
+        except Exception as e:
+            self.output(f'Job {job.name} failed: {e}')
+        finally:
+            with self._lock:
+                self._running.discard(job)
+                self.runs[job.name] += 1
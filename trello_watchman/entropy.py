@@ -0,0 +1,166 @@
+import math
+import re
+from collections import Counter
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Characters that make up candidate tokens, and the default threshold in bits per
+# character above which a token is reported. Thresholds for base64 and hex follow
+# common secret scanners
+CHARSETS = {
+    'base64': ('A-Za-z0-9+/=_-', 4.5),
+    'alphanumeric': ('A-Za-z0-9', 4.2),
+    'hex': ('0-9a-fA-F', 3.0),
+}
+
+DEFAULT_CHARSET = 'base64'
+# A token of L characters has an entropy of at most log2(L) bits per character, so the
+# default minimum length is raised where needed for tokens of that length to reach the threshold
+DEFAULT_MIN_LENGTH = 20
+
+# Below this many tokens, numpy's per call overhead outweighs vectorising
+NUMPY_MIN_TOKENS = 5
+# Tokens counted per character histogram, keeping it within the CPU cache
+TOKEN_BATCH = 4096
+
+URL_PATTERN = r'\b[a-zA-Z][a-zA-Z0-9+.-]*://[^\s<>"\')\]]+'
+
+
+def _entropies_python(tokens: list) -> list:
+    entropies = []
+    for token in tokens:
+        length = len(token)
+        entropies.append(-sum(count / length * math.log2(count / length) for count in Counter(token).values()))
+    return entropies
+
+
+def _entropies_numpy(tokens: list):
+    lengths = numpy.fromiter(map(len, tokens), dtype=numpy.int64, count=len(tokens))
+    data = numpy.frombuffer(''.join(tokens).encode('ascii'), dtype=numpy.uint8)
+    ends = numpy.cumsum(lengths)
+
+    # H = log2(L) - sum(c * log2(c)) / L over the count c of each distinct character in
+    # a token of length L. c * log2(c) is looked up from a table rather than calculated
+    counts_range = numpy.arange(int(lengths.max()) + 1, dtype=numpy.float64)
+    c_log_c = counts_range * numpy.log2(numpy.maximum(counts_range, 1))
+
+    sums = numpy.empty(len(tokens))
+    for start in range(0, len(tokens), TOKEN_BATCH):
+        end = min(start + TOKEN_BATCH, len(tokens))
+        # Count characters per token with one bincount over a (tokens x 128) histogram
+        owners = numpy.repeat(numpy.arange(end - start, dtype=numpy.int64) << 7, lengths[start:end])
+        data_start = ends[start - 1] if start else 0
+        counts = numpy.bincount(owners | data[data_start:ends[end - 1]], minlength=(end - start) << 7)
+        sums[start:end] = c_log_c[counts].reshape(end - start, 128).sum(axis=1)
+    return numpy.log2(lengths) - sums / lengths
+
+
+def shannon_entropy(tokens: list):
+    """Calculate the Shannon entropy of each token, in bits per character.
+    With numpy installed, all tokens are calculated in one vectorised batch
+
+    Args:
+        tokens: List of ASCII strings
+    Returns:
+        Sequence of entropies in the same order as the tokens, a numpy array if
+        numpy was used, otherwise a list
+    """
+
+    if numpy is not None and len(tokens) >= NUMPY_MIN_TOKENS:
+        return _entropies_numpy(tokens)
+    return _entropies_python(tokens)
+
+
+class EntropyDetector(object):
+    """Finds high entropy tokens, such as generic secrets and keys with no
+    known prefix, in text
+
+    Attributes:
+        charset: Name of the characters tokens are made of, one of CHARSETS
+        threshold: Entropy in bits per character a token must reach to be reported
+        min_length: Minimum length of a candidate token. A token of this length must
+            be able to reach the threshold, that is log2(min_length) >= threshold
+        ignore_urls: Whether to skip tokens in URLs, whose paths are often long and varied
+    """
+
+    def __init__(self,
+                 charset: str = DEFAULT_CHARSET,
+                 threshold: float = None,
+                 min_length: int = None,
+                 ignore_urls: bool = True):
+        if charset not in CHARSETS:
+            raise Exception(f'Unknown entropy charset {charset}, must be one of {", ".join(CHARSETS)}')
+        characters, default_threshold = CHARSETS.get(charset)
+        self.charset = charset
+        self.threshold = default_threshold if threshold is None else float(threshold)
+        shortest_length = math.ceil(2 ** self.threshold)
+        if min_length is None:
+            min_length = max(DEFAULT_MIN_LENGTH, shortest_length)
+        elif int(min_length) < shortest_length:
+            raise Exception(f'Entropy min_length {min_length} is too short for threshold {self.threshold}: '
+                            f'tokens shorter than {shortest_length} characters can\'t reach it, '
+                            f'as a token of length L scores at most log2(L)')
+        self.min_length = int(min_length)
+        self.ignore_urls = ignore_urls
+        token_pattern = f'(?<![{characters}])([{characters}]{{{self.min_length},}})(?![{characters}])'
+        # URLs are matched, and dropped, in the same pass as tokens, so tokens within them are skipped
+        self.token_regex = re.compile(f'{URL_PATTERN}|{token_pattern}' if ignore_urls else token_pattern)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.__dict__!r})'
+
+    def tokenize(self, text: str) -> list:
+        """Split text into candidate tokens
+
+        Args:
+            text: Text to tokenize
+        Returns:
+            List of Match objects, one for each candidate token
+        """
+
+        return [token for token in self.token_regex.finditer(text) if token.lastindex]
+
+    def search(self, text: str):
+        """Find the first token in the text at or above the entropy threshold
+
+        Args:
+            text: Text to search
+        Returns:
+            Match object for the token, or None
+        """
+
+        return self.search_many([text])[0]
+
+    def search_many(self, texts: list) -> list:
+        """Find the first token at or above the entropy threshold in each of the
+        texts. The entropy of the candidate tokens of all texts is calculated in
+        one batch, so searching many short texts together benefits from numpy
+
+        Args:
+            texts: List of texts to search
+        Returns:
+            List with a Match object for the token, or None, for each text
+        """
+
+        matches = [None] * len(texts)
+        candidates = []
+        owners = []
+        for index, text in enumerate(texts):
+            text_candidates = self.tokenize(text)
+            candidates.extend(text_candidates)
+            owners.extend([index] * len(text_candidates))
+        if not candidates:
+            return matches
+
+        entropies = shannon_entropy([candidate.group(0) for candidate in candidates])
+        if numpy is not None and isinstance(entropies, numpy.ndarray):
+            above = numpy.flatnonzero(entropies >= self.threshold).tolist()
+        else:
+            above = [position for position, entropy in enumerate(entropies) if entropy >= self.threshold]
+        for position in above:
+            if matches[owners[position]] is None:
+                matches[owners[position]] = candidates[position]
+        return matches
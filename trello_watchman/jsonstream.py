@@ -0,0 +1,120 @@
+import codecs
+import re
+import simplejson as json
+
+WHITESPACE = ' \t\n\r'
+NUMBER_START = '-0123456789'
+# Matches if only characters that can continue a number are left before the end of the buffer
+NUMBER_TAIL = re.compile(r'[0-9+\-.eE]*\Z')
+
+_DECODER = json.JSONDecoder()
+
+
+class _Reader(object):
+    """Buffers decoded text from an iterable of byte chunks, only holding
+    the part of the document that hasn't been consumed yet"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self.exhausted = False
+        self.buffer = ''
+        self.pos = 0
+
+    def fill(self) -> bool:
+        """Read the next chunk into the buffer, dropping consumed text
+
+        Returns:
+            False if there was no more data to read
+        """
+
+        if self.exhausted:
+            return False
+        try:
+            text = self._decoder.decode(next(self._chunks))
+        except StopIteration:
+            self.exhausted = True
+            text = self._decoder.decode(b'', final=True)
+        self.buffer = self.buffer[self.pos:] + text
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Skip whitespace and return the next character, or an empty string at the end of the data"""
+
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self.fill():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def take(self, expected: str) -> str:
+        """Consume the next character, which must be one of the expected characters
+
+        Args:
+            expected: Characters allowed at this point in the document
+        Returns:
+            The character consumed
+        """
+
+        char = self.peek()
+        if not char or char not in expected:
+            raise ValueError(f'Expected one of {expected!r} at character {self.pos}, found {char!r}')
+        self.pos += 1
+        return char
+
+    def value(self):
+        """Decode the next complete JSON value
+
+        Returns:
+            The decoded value
+        """
+
+        self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            # A number near the end of the buffer may continue in the next chunk. It can end
+            # before the end of the buffer, e.g. '16384.' decodes as 16384 with '.' left over
+            if self.buffer[self.pos] in NUMBER_START and NUMBER_TAIL.match(self.buffer, end) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+
+def iter_array(chunks, key: str):
+    """Incrementally decode a JSON object, yielding the elements of one of its
+    array members as they are decoded. The other members are decoded and discarded,
+    so only one element needs to be held in memory at a time
+
+    Args:
+        chunks: Iterable of UTF-8 encoded bytes making up the JSON document
+        key: Name of the top level member holding the array
+    Yields:
+        Each element of the array
+    """
+
+    reader = _Reader(chunks)
+    reader.take('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        name = reader.value()
+        reader.take(':')
+        if name == key:
+            reader.take('[')
+            if reader.peek() == ']':
+                reader.take(']')
+            else:
+                while True:
+                    yield reader.value()
+                    if reader.take(',]') == ']':
+                        break
+        else:
+            reader.value()
+        if reader.take(',}') == '}':
+            return
@@ -2,11 +2,14 @@ import os
 import logging
 import socket
 import sys
+import threading
 import logging.handlers
 import simplejson as json
 from datetime import datetime
 from logging import Logger
 
+from trello_watchman import store
+
 
 class LoggingBase(Logger):
     def __init__(self, name='Trello Watchman'):
@@ -17,7 +20,11 @@ class LoggingBase(Logger):
         self.info_format = logging.Formatter(
             '{"localtime": "%(asctime)s", "level": "%(levelname)s", "source": "%(name)s", "message":'
             ' "%(message)s"}')
+        self.board_format = logging.Formatter(
+            '{"localtime": "%(asctime)s", "level": "BOARD", "source": "%(name)s", "board_data": %(message)s}')
         self.log_path = ''
+        # Formatters are swapped per record, so records from concurrent threads are logged one at a time
+        self.lock = threading.Lock()
         self.logger = logging.getLogger(self.name)
         self.logger.setLevel(logging.DEBUG)
 
@@ -25,24 +32,33 @@ class LoggingBase(Logger):
 class FileLogger(LoggingBase):
     def __init__(self, log_path):
         LoggingBase.__init__(self)
+        self.log_path = log_path
         self.handler = logging.handlers.WatchedFileHandler(os.path.join(log_path, 'trello_watchman.log'))
         self.logger.addHandler(self.handler)
 
     def log_notification(self, log_data, scope, detect_type, severity):
-        self.handler.setFormatter(self.notify_format)
-        self.logger.warning(json.dumps(log_data), extra={
-            'scope': scope,
-            'type': detect_type,
-            'severity': severity
-        })
+        with self.lock:
+            self.handler.setFormatter(self.notify_format)
+            self.logger.warning(json.dumps(log_data), extra={
+                'scope': scope,
+                'type': detect_type,
+                'severity': severity
+            })
+
+    def log_board(self, board_data):
+        with self.lock:
+            self.handler.setFormatter(self.board_format)
+            self.logger.info(json.dumps(board_data))
 
     def log_info(self, log_data):
-        self.handler.setFormatter(self.info_format)
-        self.logger.info(log_data)
+        with self.lock:
+            self.handler.setFormatter(self.info_format)
+            self.logger.info(log_data)
 
     def log_critical(self, log_data):
-        self.handler.setFormatter(self.info_format)
-        self.logger.critical(log_data)
+        with self.lock:
+            self.handler.setFormatter(self.info_format)
+            self.logger.critical(log_data)
 
 
 class StdoutLogger(LoggingBase):
@@ -52,26 +68,35 @@ class StdoutLogger(LoggingBase):
         self.logger.addHandler(self.handler)
 
     def log_notification(self, log_data, scope, detect_type, severity):
-        self.handler.setFormatter(self.notify_format)
-        self.logger.warning(json.dumps(log_data), extra={
-            'scope': scope,
-            'type': detect_type,
-            'severity': severity
-        })
+        with self.lock:
+            self.handler.setFormatter(self.notify_format)
+            self.logger.warning(json.dumps(log_data), extra={
+                'scope': scope,
+                'type': detect_type,
+                'severity': severity
+            })
+
+    def log_board(self, board_data):
+        with self.lock:
+            self.handler.setFormatter(self.board_format)
+            self.logger.info(json.dumps(board_data))
 
     def log_info(self, log_data):
-        self.handler.setFormatter(self.info_format)
-        self.logger.info(log_data)
+        with self.lock:
+            self.handler.setFormatter(self.info_format)
+            self.logger.info(log_data)
 
     def log_critical(self, log_data):
-        self.handler.setFormatter(self.info_format)
-        self.logger.critical(log_data)
+        with self.lock:
+            self.handler.setFormatter(self.info_format)
+            self.logger.critical(log_data)
 
 
 class SocketJSONLogger(object):
     def __init__(self, host, port):
         self.host = host
         self.port = port
+        self.lock = threading.Lock()
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
             self.sock.connect((self.host, self.port))
@@ -80,7 +105,8 @@ class SocketJSONLogger(object):
 
     def send(self, data):
         try:
-            self.sock.sendall(bytes(data, encoding="utf-8"))
+            with self.lock:
+                self.sock.sendall(bytes(data, encoding="utf-8"))
         except Exception as e:
             print(e)
 
@@ -96,6 +122,15 @@ class SocketJSONLogger(object):
         }) + '\n'
         self.send(message)
 
+    def log_board(self, board_data):
+        message = json.dumps({
+            'localtime': datetime.now().strftime('%Y-%m-%d %H:%M:%S,%f'),
+            'level': 'BOARD',
+            'source': 'Trello Watchman',
+            'board_data': board_data
+        }) + '\n'
+        self.send(message)
+
     def log_info(self, log_data):
         message = json.dumps({
             'localtime': datetime.now().strftime('%Y-%m-%d %H:%M:%S,%f'),
@@ -112,4 +147,26 @@ class SocketJSONLogger(object):
             'source': 'Trello Watchman',
             'message': log_data
         }) + '\n'
-        self.send(message)
\ No newline at end of file
+        self.send(message)
+
+
+class SQLiteLogger(object):
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.log_path = os.path.dirname(db_path)
+        self.store = store.FindingsStore(db_path)
+
+    def log_notification(self, log_data, scope, detect_type, severity):
+        self.store.add(log_data, scope, detect_type, severity)
+
+    def log_board(self, board_data):
+        self.store.add_board(board_data)
+
+    def log_info(self, log_data):
+        print(log_data)
+
+    def log_critical(self, log_data):
+        print(log_data)
+
+    def close(self):
+        self.store.close()
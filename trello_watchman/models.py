@@ -0,0 +1,150 @@
+class Member(object):
+    """Trello board member. Instances are interned per connection, so every
+    board a member belongs to references the same object"""
+
+    __slots__ = ('id', 'username')
+
+    def __init__(self, id: str, username: str):
+        self.id = id
+        self.username = username
+
+    def _asdict(self) -> dict:
+        return {
+            'id': self.id,
+            'username': self.username
+        }
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self._asdict()!r})'
+
+
+class Board(object):
+    """Trello board a finding was made on. Instances are interned per
+    connection and shared by every finding made on the board"""
+
+    __slots__ = ('id', 'name', 'description', 'closed', 'url', 'members')
+
+    def __init__(self, id: str, name: str, description: str, closed: bool, url: str, members: tuple):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.closed = closed
+        self.url = url
+        self.members = members
+
+    def _asdict(self) -> dict:
+        return {
+            'id': self.id,
+            'name': self.name,
+            'description': self.description,
+            'closed': self.closed,
+            'url': self.url,
+            'members': [member._asdict() for member in self.members]
+        }
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self._asdict()!r})'
+
+
+class Attachment(object):
+    """Attachment on a Trello card"""
+
+    __slots__ = ('id', 'name', 'uploaded', 'filename', 'url')
+
+    def __init__(self, id: str, name: str, uploaded: str, filename: str, url: str):
+        self.id = id
+        self.name = name
+        self.uploaded = uploaded
+        self.filename = filename
+        self.url = url
+
+    def _asdict(self) -> dict:
+        return {
+            'id': self.id,
+            'name': self.name,
+            'uploaded': self.uploaded,
+            'filename': self.filename,
+            'url': self.url
+        }
+
+
+class Result(object):
+    """Base class for findings made on a Trello card. The board is held
+    as a reference to the shared Board object rather than a copy"""
+
+    __slots__ = ('card_id', 'last_activity', 'title', 'description', 'url', 'board')
+
+    def __init__(self, card_id: str, last_activity: str, title: str, description: str, url: str, board: Board):
+        self.card_id = card_id
+        self.last_activity = last_activity
+        self.title = title
+        self.description = description
+        self.url = url
+        self.board = board
+
+    def _fields(self) -> dict:
+        return {
+            'card_id': self.card_id,
+            'last_activity': self.last_activity,
+            'title': self.title,
+            'description': self.description,
+            'url': self.url
+        }
+
+    def _asdict(self) -> dict:
+        """Finding with the full board embedded
+
+        Returns:
+            Dict ready to be logged as JSON
+        """
+
+        fields = self._fields()
+        fields['board'] = self.board._asdict()
+        return fields
+
+    def as_reference(self) -> dict:
+        """Finding with the board referenced by ID only. The board metadata
+        is expected to be logged separately, once per run
+
+        Returns:
+            Dict ready to be logged as JSON
+        """
+
+        fields = self._fields()
+        fields['board_id'] = self.board.id
+        return fields
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.as_reference()!r})'
+
+
+class TextResult(Result):
+    """Finding for text matched in a Trello card"""
+
+    __slots__ = ('match_string',)
+
+    def __init__(self, card_id: str, last_activity: str, title: str, description: str, url: str,
+                 match_string: str, board: Board):
+        super().__init__(card_id, last_activity, title, description, url, board)
+        self.match_string = match_string
+
+    def _fields(self) -> dict:
+        fields = super()._fields()
+        fields['match_string'] = self.match_string
+        return fields
+
+
+class AttachmentResult(Result):
+    """Finding for attachments on a Trello card"""
+
+    __slots__ = ('attachments',)
+
+    def __init__(self, card_id: str, last_activity: str, title: str, description: str, url: str,
+                 attachments: list, board: Board):
+        super().__init__(card_id, last_activity, title, description, url, board)
+        self.attachments = attachments
+
+    def _fields(self) -> dict:
+        fields = super()._fields()
+        fields['attachments'] = [attachment._asdict() for attachment in self.attachments]
+        return fields
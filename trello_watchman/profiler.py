@@ -0,0 +1,279 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+PROFILER = None
+
+SAMPLE_INTERVAL = 0.005
+
+_cpu_time = getattr(time, 'thread_time', time.process_time)
+
+
+class _NullPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class _Phase(object):
+    def __init__(self, profiler, name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler._enter(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler._exit(self)
+        return False
+
+
+class Profiler(object):
+    """Profiles an audit, recording wall and CPU time for each phase of the run,
+    and sampling the call stacks of all threads for a flamegraph
+
+    Phases can be nested, e.g. network requests made while searching. The
+    total time of a phase includes its nested phases, the self time doesn't.
+
+    Phases are timed in every thread. cProfile only profiles the thread that
+    enables it before Python 3.12, so there each thread started while profiling,
+    such as --parallel search workers and daemon jobs, gets its own cProfile
+    profile, merged into the report.
+
+    Attributes:
+        phases: Dict of [calls, wall, self wall, cpu, self cpu, peak memory] lists by phase name
+        stacks: Counter of sampled call stacks in collapsed format
+        use_cprofile: Whether to run cProfile over the audit
+        use_tracemalloc: Whether to trace memory allocations and snapshot them after each phase
+    """
+
+    def __init__(self, use_cprofile: bool = False, use_tracemalloc: bool = False,
+                 sample_interval: float = SAMPLE_INTERVAL):
+        self.use_cprofile = use_cprofile
+        self.use_tracemalloc = use_tracemalloc
+        self.sample_interval = sample_interval
+        self.phases = {}
+        self.snapshots = {}
+        self.stacks = Counter()
+        self.started = None
+        self.wall = 0
+        self.cpu = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._running = threading.Event()
+        self._sampler = None
+        self._cprofile = None
+        self._thread_profiles = []
+
+    def start(self):
+        """Start profiling and sampling stacks"""
+
+        self.started = (time.perf_counter(), time.process_time())
+        if self.use_tracemalloc:
+            tracemalloc.start()
+        self._running.set()
+        self._sampler = threading.Thread(target=self._sample, name='profiler', daemon=True)
+        self._sampler.start()
+        if self.use_cprofile:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+            if sys.version_info < (3, 12):
+                threading.setprofile(self._profile_thread)
+
+    def stop(self):
+        """Stop profiling"""
+
+        self._running.clear()
+        if self._sampler:
+            self._sampler.join()
+        if self._cprofile:
+            threading.setprofile(None)
+            self._cprofile.disable()
+        if self.use_tracemalloc and tracemalloc.is_tracing():
+            self.snapshots['end of run'] = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+        self.wall = time.perf_counter() - self.started[0]
+        self.cpu = time.process_time() - self.started[1]
+
+    def phase(self, name: str) -> _Phase:
+        return _Phase(self, name)
+
+    def _profile_thread(self, frame, event, arg):
+        # Called by the first profiling event of each new thread, replacing itself with a cProfile profile
+        profile = cProfile.Profile()
+        with self._lock:
+            self._thread_profiles.append(profile)
+        profile.enable()
+
+    def _cprofile_stats(self) -> pstats.Stats:
+        stats = pstats.Stats(self._cprofile)
+        with self._lock:
+            thread_profiles = list(self._thread_profiles)
+        for profile in thread_profiles:
+            try:
+                stats.add(profile)
+            except TypeError:
+                # Threads that made no calls while profiled have no stats
+                pass
+        return stats
+
+    def _enter(self, phase: _Phase):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        if not stack and self.use_tracemalloc and hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        phase.child_wall = phase.child_cpu = 0
+        stack.append(phase)
+        phase.wall = time.perf_counter()
+        phase.cpu = _cpu_time()
+
+    def _exit(self, phase: _Phase):
+        wall = time.perf_counter() - phase.wall
+        cpu = _cpu_time() - phase.cpu
+        stack = self._local.stack
+        stack.pop()
+        if stack:
+            stack[-1].child_wall += wall
+            stack[-1].child_cpu += cpu
+            peak = 0
+        elif self.use_tracemalloc:
+            peak = tracemalloc.get_traced_memory()[1]
+        else:
+            peak = 0
+
+        with self._lock:
+            stats = self.phases.setdefault(phase.name, [0, 0, 0, 0, 0, 0])
+            stats[0] += 1
+            stats[1] += wall
+            stats[2] += wall - phase.child_wall
+            stats[3] += cpu
+            stats[4] += cpu - phase.child_cpu
+            stats[5] = max(stats[5], peak)
+        if not stack and self.use_tracemalloc:
+            self.snapshots[phase.name] = tracemalloc.take_snapshot()
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        while self._running.is_set():
+            time.sleep(self.sample_interval)
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def report(self) -> str:
+        """Build the text report of the profile
+
+        Returns:
+            Report with the phase timings, and cProfile and tracemalloc statistics if enabled
+        """
+
+        lines = [f'Total: {self.wall:.3f}s wall, {self.cpu:.3f}s CPU', '',
+                 f'{"phase":<20}{"calls":>8}{"wall":>11}{"self wall":>11}{"cpu":>11}{"self cpu":>11}'
+                 f'{"peak memory":>14}']
+        phases = sorted(self.phases.items(), key=lambda item: -item[1][2])
+        for name, (calls, wall, self_wall, cpu, self_cpu, peak) in phases:
+            lines.append(f'{name:<20}{calls:>8}{wall:>10.3f}s{self_wall:>10.3f}s{cpu:>10.3f}s{self_cpu:>10.3f}s'
+                         f'{(f"{peak / 1024 / 1024:.1f}MB" if peak else "-"):>14}')
+
+        if self._cprofile:
+            stream = io.StringIO()
+            stats = self._cprofile_stats()
+            stats.stream = stream
+            stats.sort_stats('cumulative').print_stats(30)
+            lines.extend(['', 'cProfile of all threads, top 30 by cumulative time', stream.getvalue()])
+
+        for name, snapshot in self.snapshots.items():
+            lines.extend(['', f'tracemalloc snapshot after {name}, top 10 by size'])
+            for stat in snapshot.statistics('lineno')[:10]:
+                lines.append(str(stat))
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self, output_dir: str) -> list:
+        """Write the report, the collapsed stacks for flamegraph.pl/speedscope and
+        the cProfile stats to the output directory
+
+        Args:
+            output_dir: Directory to write the files to
+        Returns:
+            List of paths written
+        """
+
+        paths = [os.path.join(output_dir, 'trello_watchman_profile.txt'),
+                 os.path.join(output_dir, 'trello_watchman_profile.collapsed')]
+        with open(paths[0], 'w') as report_file:
+            report_file.write(self.report())
+        with open(paths[1], 'w') as stacks_file:
+            for stack, count in self.stacks.most_common():
+                stacks_file.write(f'{stack} {count}\n')
+        if self._cprofile:
+            paths.append(os.path.join(output_dir, 'trello_watchman_profile.pstats'))
+            self._cprofile_stats().dump_stats(paths[-1])
+        return paths
+
+
+def phase(name: str):
+    """Time a phase of the audit with the active profiler
+
+    Args:
+        name: Name of the phase
+    Returns:
+        Context manager timing the phase, which does nothing if profiling is off
+    """
+
+    if PROFILER is None:
+        return _NULL_PHASE
+    return PROFILER.phase(name)
+
+
+def start(use_cprofile: bool = False, use_tracemalloc: bool = False) -> Profiler:
+    """Create and start the active profiler
+
+    Args:
+        use_cprofile: Whether to run cProfile over the audit
+        use_tracemalloc: Whether to trace memory allocations
+    Returns:
+        The active Profiler object
+    """
+
+    global PROFILER
+
+    PROFILER = Profiler(use_cprofile, use_tracemalloc)
+    PROFILER.start()
+    return PROFILER
+
+
+def stop() -> Profiler:
+    """Stop the active profiler
+
+    Returns:
+        The stopped Profiler object, or None if profiling was not started
+    """
+
+    global PROFILER
+
+    profiler, PROFILER = PROFILER, None
+    if profiler:
+        profiler.stop()
+    return profiler
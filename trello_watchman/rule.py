@@ -1,6 +1,62 @@
+import concurrent.futures
+import hashlib
+import math
+import multiprocessing
+import os
 import pathlib
+import random
+import re
+import signal
+import sys
+import threading
+import time
+import warnings
 import yaml
+import simplejson as json
 from collections import namedtuple
+from typing import Pattern
+
+from trello_watchman import entropy as entropy_engine
+from trello_watchman import profiler
+
+try:
+    from re import _parser as sre_parse
+    from re import _constants as sre_constants
+except ImportError:
+    import sre_parse
+    import sre_constants
+
+# Anchors shorter than this appear in too much text to be worth checking
+MIN_ANCHOR_LENGTH = 3
+
+# Seconds a single search with a rule's pattern may take before the rule is skipped
+DEFAULT_MATCH_TIMEOUT = 5.0
+
+# Benchmark inputs grow from the min to the max size, stopping early once a search is slow
+BENCHMARK_MIN_SIZE = 16
+BENCHMARK_MAX_SIZE = 32768
+BENCHMARK_SLOW = 0.05
+BENCHMARK_TIMEOUT = 10.0
+# Timings below the resolution are mostly fixed overhead and timer noise, so are left out of the
+# growth estimate. An input only counts as super-linear if its largest search also took at least
+# BENCHMARK_MIN_SLOW_TIME, and the verdict holds over BENCHMARK_RETRIES more runs
+BENCHMARK_RESOLUTION = 0.0001
+BENCHMARK_MIN_SLOW_TIME = 0.01
+BENCHMARK_RETRIES = 2
+SUPER_LINEAR_EXPONENT = 1.5
+# Benchmark verdicts are kept between runs, so only new or changed patterns are benchmarked when rules load
+DEFAULT_BENCHMARK_CACHE = os.path.join(os.path.expanduser('~'), '.trello_watchman', 'rule_benchmarks.json')
+
+# Worker processes are started from a clean server process rather than forked from a process
+# that may be running searches in several threads
+_MP_CONTEXT = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+
+BENCHMARK = namedtuple('Benchmark', ('verdict', 'exponent', 'worst_input', 'timings'))
+
+
+class MatchTimeout(Exception):
+    """Raised when searching text with a rule's pattern takes longer than its time budget"""
 
 
 class Rule(object):
@@ -13,7 +69,11 @@ class Rule(object):
                  scope: list,
                  test_cases: namedtuple,
                  strings: str,
-                 pattern: str):
+                 pattern: str,
+                 keywords: list = None,
+                 match_timeout: float = None,
+                 category: str = None,
+                 entropy: dict = None):
         self.filename = filename
         self.enabled = enabled
         self.meta = meta
@@ -21,6 +81,16 @@ class Rule(object):
         self.test_cases = test_cases
         self.strings = strings
         self.pattern = pattern
+        self.keywords = keywords
+        self.match_timeout = match_timeout
+        self.category = category
+        self.entropy = entropy
+        self.detector = entropy_engine.EntropyDetector(**entropy) if entropy else None
+        self.regex = re.compile(pattern or '')
+        if keywords:
+            self.anchors = [str(keyword).lower() for keyword in keywords]
+        else:
+            self.anchors = extract_anchors(pattern or '')
 
     def __repr__(self):
         return f'{self.__class__.__name__}({self.__dict__!r})'
@@ -28,12 +98,495 @@ class Rule(object):
     def __str__(self):
         return ' '.join(f'{k}: {v!s}' for k, v in self.__dict__.items())
 
+    def may_match(self, text: str) -> bool:
+        """Cheap check whether the rule's pattern could match the text, used
+        to skip running the regex on text that contains none of the rule's anchors
+
+        Args:
+            text: Text to check
+        Returns:
+            False if the pattern cannot match the text, True otherwise
+        """
+
+        if not self.anchors:
+            return True
+        text = text.lower()
+        return any(anchor in text for anchor in self.anchors)
+
+    def search(self, text: str):
+        """Search the text with the rule's pattern, skipping the regex
+        when the text contains none of the rule's anchors. If the rule has a
+        match timeout, the search runs in the regex worker process so it can
+        be stopped when it takes too long. Entropy rules then look for a high
+        entropy token in text the pattern matched
+
+        Args:
+            text: Text to search
+        Returns:
+            Match object for the first match, or None
+        Raises:
+            MatchTimeout: The search took longer than the rule's match timeout
+        """
+
+        with profiler.phase('filtering'):
+            match = self._search_pattern(text)
+            if match and self.detector:
+                return self.detector.search(text)
+            return match
+
+    def search_many(self, texts: list) -> list:
+        """Search each of the texts as search does. For entropy rules, the
+        entropy of the tokens in all texts the pattern matched is calculated
+        in one batch
+
+        Args:
+            texts: List of texts to search
+        Returns:
+            List with a Match object for the first match, or None, for each text
+        Raises:
+            MatchTimeout: A search took longer than the rule's match timeout
+        """
+
+        with profiler.phase('filtering'):
+            matches = [self._search_pattern(text) for text in texts]
+            if self.detector:
+                matched = [index for index, match in enumerate(matches) if match]
+                matches = [None] * len(texts)
+                for index, match in zip(matched, self.detector.search_many([texts[index] for index in matched])):
+                    matches[index] = match
+            return matches
+
+    def _search_pattern(self, text: str):
+        if not self.may_match(text):
+            return None
+        if self.match_timeout and self.pattern:
+            try:
+                return thread_guard().search(self.regex, text, self.match_timeout)
+            except MatchTimeout:
+                raise MatchTimeout(f'{self.filename}: pattern took longer than {self.match_timeout}s '
+                                   f'to search {len(text)} characters')
+        return self.regex.search(text)
+
+
+class GuardedMatch(object):
+    """Match found by the regex worker process, with the parts of the
+    re.Match interface results are built from"""
+
+    __slots__ = ('string', '_span')
+
+    def __init__(self, string: str, span: tuple):
+        self.string = string
+        self._span = span
+
+    def span(self) -> tuple:
+        return self._span
+
+    def start(self) -> int:
+        return self._span[0]
+
+    def end(self) -> int:
+        return self._span[1]
+
+    def group(self, index: int = 0) -> str:
+        if index != 0:
+            raise IndexError('Only the whole match is available from the regex worker')
+        return self.string[self._span[0]:self._span[1]]
+
+
+def _regex_worker(conn):
+    # A worker must not run the daemon's SIGTERM handler, which can't run while a
+    # regex is searching, so restore the default to let a timed out search be terminated
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    compiled = {}
+    while True:
+        try:
+            pattern, flags, text = conn.recv()
+        except EOFError:
+            return
+        regex = compiled.get((pattern, flags))
+        if regex is None:
+            regex = compiled[(pattern, flags)] = re.compile(pattern, flags)
+        match = regex.search(text)
+        conn.send(match.span() if match else None)
+
+
+class RegexGuard(object):
+    """Runs regex searches in a worker process, so a search that backtracks
+    catastrophically can be stopped when it exceeds its time budget. Python
+    can't interrupt a running regex in the same process.
+
+    Each thread searches through its own guard from thread_guard, so parallel
+    searches don't wait on one worker. The worker exits when its thread ends
+    and the guard's end of the pipe is closed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._process = None
+        self._conn = None
+
+    def _start(self):
+        self._conn, child_conn = _MP_CONTEXT.Pipe()
+        self._process = _MP_CONTEXT.Process(target=_regex_worker, args=(child_conn,), daemon=True)
+        self._process.start()
+        child_conn.close()
+
+    def stop(self):
+        """Stop the worker process. It is restarted by the next search"""
+
+        if self._process:
+            self._process.terminate()
+            self._process.join()
+            self._conn.close()
+            self._process = self._conn = None
+
+    def search(self, regex: Pattern, text: str, timeout: float) -> GuardedMatch or None:
+        """Search the text with a compiled regex in the worker process
+
+        Args:
+            regex: Compiled regex to search with
+            text: Text to search
+            timeout: Seconds to wait for the search to finish
+        Returns:
+            GuardedMatch object for the first match, or None
+        Raises:
+            MatchTimeout: The search took longer than the timeout. The worker is stopped
+        """
+
+        with self._lock:
+            if self._process is None or not self._process.is_alive():
+                self._start()
+            self._conn.send((regex.pattern, regex.flags, text))
+            if not self._conn.poll(timeout):
+                self.stop()
+                raise MatchTimeout(f'Pattern took longer than {timeout}s')
+            span = self._conn.recv()
+        if span is not None:
+            return GuardedMatch(text, span)
+
+
+_GUARDS = threading.local()
+
+
+def thread_guard() -> RegexGuard:
+    """Get the current thread's regex guard, creating it on first use
+
+    Returns:
+        RegexGuard object of the current thread
+    """
+
+    guard = getattr(_GUARDS, 'guard', None)
+    if guard is None:
+        guard = _GUARDS.guard = RegexGuard()
+    return guard
+
+
+_CATEGORY_SAMPLES = {
+    'CATEGORY_DIGIT': '0',
+    'CATEGORY_NOT_DIGIT': 'a',
+    'CATEGORY_WORD': 'a',
+    'CATEGORY_NOT_WORD': '-',
+    'CATEGORY_SPACE': ' ',
+    'CATEGORY_NOT_SPACE': 'a',
+}
+
+
+def _sample_pattern(parsed, chars: set, runs: set):
+    """Collect characters and literal strings the pattern accepts, to build benchmark inputs from"""
+
+    run = []
+    for op, av in list(parsed) + [(None, None)]:
+        if op is sre_constants.LITERAL:
+            chars.add(chr(av))
+            run.append(chr(av))
+            continue
+        if len(run) > 1:
+            runs.add(''.join(run))
+        run = []
+
+        if op is sre_constants.IN:
+            for item_op, item_av in av:
+                if item_op is sre_constants.LITERAL:
+                    chars.add(chr(item_av))
+                elif item_op is sre_constants.RANGE:
+                    chars.update((chr(item_av[0]), chr(item_av[1])))
+                elif item_op is sre_constants.CATEGORY:
+                    chars.add(_CATEGORY_SAMPLES.get(str(item_av), 'a'))
+        elif op is sre_constants.SUBPATTERN:
+            _sample_pattern(av[-1], chars, runs)
+        elif op is sre_constants.BRANCH:
+            for branch in av[1]:
+                _sample_pattern(branch, chars, runs)
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) or \
+                op is getattr(sre_constants, 'POSSESSIVE_REPEAT', None):
+            _sample_pattern(av[2], chars, runs)
+        elif op is getattr(sre_constants, 'ATOMIC_GROUP', None):
+            _sample_pattern(av, chars, runs)
+        elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            _sample_pattern(av[1], chars, runs)
+
+
+def benchmark_inputs(pattern: str) -> list:
+    """Build adversarial benchmark inputs for a pattern: runs of characters and
+    literals the pattern accepts, which make backtracking patterns try many ways
+    to match before failing, plus realistic card text
+
+    Args:
+        pattern: Regex pattern to build inputs for
+    Returns:
+        List of (label, unit) tuples, where the input is the unit repeated
+    """
+
+    chars = {'a', '0', ' '}
+    runs = set()
+    _sample_pattern(sre_parse.parse(pattern), chars, runs)
+    chars = sorted(chars)[:16]
+    units = [(f'{c!r} repeated', c) for c in chars]
+    units.extend((f'{a + b!r} repeated', a + b) for i, a in enumerate(chars[:6]) for b in chars[i + 1:6])
+    units.extend((f'{r!r} repeated', r) for r in sorted(runs)[:8])
+    units.extend((f'{r + " "!r} repeated', r + ' ') for r in sorted(runs)[:8])
+
+    rand = random.Random(0)
+    alphabet = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789' + ' ' * 10 + '.,:;-_/=\'"\n'
+    units.append(('card text', ''.join(rand.choice(alphabet) for _ in range(BENCHMARK_MAX_SIZE))))
+    return units
+
+
+def _benchmark_worker(pattern: str, labels: list, conn):
+    regex = re.compile(pattern)
+    for label, unit in benchmark_inputs(pattern):
+        if labels is not None and label not in labels:
+            continue
+        timings = []
+        size = BENCHMARK_MIN_SIZE
+        while size <= BENCHMARK_MAX_SIZE:
+            # Repeat with an unmatchable character at the end, forcing the pattern to fail after backtracking
+            text = (unit * (size // len(unit) + 1))[:size] + '\x00'
+            elapsed = None
+            for _ in range(3):
+                start = time.perf_counter()
+                regex.search(text)
+                elapsed = min(elapsed or math.inf, time.perf_counter() - start)
+                if elapsed > BENCHMARK_SLOW / 10:
+                    break
+            timings.append((size, elapsed))
+            conn.send((label, timings))
+            if elapsed > BENCHMARK_SLOW:
+                break
+            size *= 2
+    conn.send(None)
+    conn.close()
+
+
+def _growth_exponent(timings: list) -> float:
+    """Estimate how search time grows with input size, as the least squares slope
+    of log time against log size over all sizes measured above the timer resolution.
+    1 is linear, 2 quadratic. Fewer than three measurable sizes count as linear"""
+
+    points = [(math.log(size), math.log(elapsed)) for size, elapsed in timings if elapsed >= BENCHMARK_RESOLUTION]
+    if len(points) < 3:
+        return 1.0
+    mean_size = sum(size for size, _ in points) / len(points)
+    mean_time = sum(elapsed for _, elapsed in points) / len(points)
+    variance = sum((size - mean_size) ** 2 for size, _ in points)
+    return sum((size - mean_size) * (elapsed - mean_time) for size, elapsed in points) / variance
+
+
+def _is_super_linear(timings: list) -> bool:
+    return timings[-1][1] >= BENCHMARK_MIN_SLOW_TIME and _growth_exponent(timings) > SUPER_LINEAR_EXPONENT
+
+
+def _run_benchmark(pattern: str, timeout: float, labels: list = None) -> tuple:
+    """Run the benchmark worker for a pattern's inputs, or only the inputs labelled
+
+    Returns:
+        Tuple of timings by input label, and the label of the input being searched
+        when the timeout ran out, or None if the benchmark finished
+    """
+
+    recv_conn, send_conn = _MP_CONTEXT.Pipe(duplex=False)
+    process = _MP_CONTEXT.Process(target=_benchmark_worker, args=(pattern, labels, send_conn), daemon=True)
+    process.start()
+    send_conn.close()
+
+    timings = {}
+    label = None
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not recv_conn.poll(remaining):
+                return timings, label
+            message = recv_conn.recv()
+            if message is None:
+                return timings, None
+            label, timings[label] = message
+    finally:
+        process.terminate()
+        process.join()
+        recv_conn.close()
+
+
+def benchmark_pattern(pattern: str, timeout: float = BENCHMARK_TIMEOUT) -> BENCHMARK:
+    """Time a pattern against adversarial and large synthetic inputs of growing
+    size in a separate process, to find patterns that backtrack super-linearly
+
+    An input is super-linear if search time grows faster than size to the power
+    of SUPER_LINEAR_EXPONENT and the largest search was slow enough to measure
+    reliably. Inputs found super-linear are benchmarked again, and only kept if
+    every run agrees, so timer noise on fast patterns doesn't give a verdict.
+
+    Args:
+        pattern: Regex pattern to benchmark
+        timeout: Seconds to allow the whole benchmark to run
+    Returns:
+        Benchmark namedtuple. The verdict is 'linear', 'super-linear' if search time
+        grows faster than linearly with input size, or 'catastrophic' if the
+        benchmark did not finish within the timeout
+    """
+
+    if not pattern:
+        return BENCHMARK('linear', 1.0, None, {})
+
+    timings, unfinished = _run_benchmark(pattern, timeout)
+    if unfinished is not None:
+        return BENCHMARK('catastrophic', math.inf, unfinished, timings)
+
+    suspects = [label for label, label_timings in timings.items() if _is_super_linear(label_timings)]
+    for _ in range(BENCHMARK_RETRIES):
+        if not suspects:
+            break
+        retry_timings, unfinished = _run_benchmark(pattern, timeout, suspects)
+        if unfinished is not None:
+            return BENCHMARK('catastrophic', math.inf, unfinished, retry_timings)
+        suspects = [label for label in suspects if _is_super_linear(retry_timings[label])]
+        # Keep the run with the slower growth, so the exponent reported is the least any run measured
+        for label in retry_timings:
+            if _growth_exponent(retry_timings[label]) < _growth_exponent(timings[label]):
+                timings[label] = retry_timings[label]
+
+    exponents = {label: _growth_exponent(label_timings) for label, label_timings in timings.items()}
+    if suspects:
+        worst_input = max(suspects, key=exponents.get)
+        return BENCHMARK('super-linear', exponents[worst_input], worst_input, timings)
+    worst_input = max(exponents, key=exponents.get)
+    return BENCHMARK('linear', exponents[worst_input], worst_input, timings)
+
+
+def _benchmark_key(pattern: str) -> str:
+    # Backtracking behaviour can change between versions of the regex engine
+    return hashlib.sha256(json.dumps([pattern, sys.version_info[:2]]).encode('utf-8')).hexdigest()
+
 
-def load_from_yaml(rule_path: pathlib.PosixPath) -> Rule:
+def benchmark_patterns(patterns: list, cache_path: str = None, workers: int = None) -> dict:
+    """Benchmark several patterns, running a benchmark per CPU at a time and
+    reusing verdicts cached by earlier runs
+
+    Args:
+        patterns: Regex patterns to benchmark
+        cache_path: JSON file to read and store verdicts in, or None to always benchmark
+        workers: Number of benchmarks to run at a time, defaults to the number of CPUs
+    Returns:
+        Dict of Benchmark namedtuples by pattern. Cached benchmarks have no timings
+    """
+
+    cached = {}
+    if cache_path:
+        try:
+            with open(cache_path) as cache_file:
+                cached = json.load(cache_file)
+        except (OSError, ValueError):
+            pass
+
+    keys = {pattern: _benchmark_key(pattern) for pattern in patterns}
+    results = {pattern: BENCHMARK(*cached.get(key), {}) for pattern, key in keys.items() if key in cached}
+    pending = [pattern for pattern in keys if pattern not in results]
+    if not pending:
+        return results
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+        for pattern, result in zip(pending, executor.map(benchmark_pattern, pending)):
+            results[pattern] = result
+            cached[keys.get(pattern)] = [result.verdict, result.exponent, result.worst_input]
+
+    if cache_path:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        temp_path = f'{cache_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w') as cache_file:
+            json.dump(cached, cache_file)
+        os.replace(temp_path, cache_path)
+    return results
+
+
+def _required_literals(parsed) -> set or None:
+    """Find a set of literal strings, at least one of which must appear in
+    any text matched by a parsed regex sequence
+
+    Args:
+        parsed: Parsed regex sequence from sre_parse
+    Returns:
+        Set of lowercase literal strings, or None if no literals are required
+    """
+
+    candidates = []
+    run = []
+
+    for op, av in list(parsed) + [(None, None)]:
+        if op is sre_constants.LITERAL:
+            run.append(chr(av))
+            continue
+        if run:
+            candidates.append({''.join(run).lower()})
+            run = []
+
+        if op is sre_constants.SUBPATTERN:
+            literals = _required_literals(av[-1])
+        elif op is sre_constants.BRANCH:
+            branches = [_required_literals(branch) for branch in av[1]]
+            literals = set().union(*branches) if all(branches) else None
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) or \
+                op is getattr(sre_constants, 'POSSESSIVE_REPEAT', None):
+            literals = _required_literals(av[2]) if av[0] >= 1 else None
+        elif op is getattr(sre_constants, 'ATOMIC_GROUP', None):
+            literals = _required_literals(av)
+        else:
+            literals = None
+
+        if literals:
+            candidates.append(literals)
+
+    if candidates:
+        return max(candidates, key=lambda literals: min(len(literal) for literal in literals))
+
+
+def extract_anchors(pattern: str) -> list:
+    """Extract literal anchors from a regex pattern. Any text the pattern
+    matches contains at least one of the anchors, ignoring case
+
+    Args:
+        pattern: Regex pattern to extract anchors from
+    Returns:
+        List of lowercase anchor strings, empty if the pattern has no usable anchors
+    """
+
+    try:
+        literals = _required_literals(sre_parse.parse(pattern))
+    except (re.error, RecursionError):
+        return []
+    if not literals or min(len(literal) for literal in literals) < MIN_ANCHOR_LENGTH:
+        return []
+    return sorted(literals)
+
+
+def load_from_yaml(rule_path: pathlib.PosixPath, match_timeout: float = None, benchmark: bool = False) -> Rule:
     """Load YAML file and return a Rule object
 
     Args:
         rule_path: Path of YAML file
+        match_timeout: Seconds a single search with the rule's pattern may take, or None for no limit
+        benchmark: Whether to benchmark the rule's pattern, rejecting it if it backtracks catastrophically.
+            The match timeout is then only applied if the pattern is super-linear, and other patterns
+            are searched directly without the regex worker
     Returns:
         Definition object with fields populated from the YAML
         definition file
@@ -52,7 +605,7 @@ def load_from_yaml(rule_path: pathlib.PosixPath) -> Rule:
 
         test_cases = namedtuple('test_cases', ['match_cases', 'fail_cases'])
         test_cases.match_cases = yaml_import.get('test_cases').get('match_cases')
-        test_cases.match_cases = yaml_import.get('test_cases').get('fail_cases')
+        test_cases.fail_cases = yaml_import.get('test_cases').get('fail_cases')
 
         rule = Rule(filename=yaml_import.get('filename'),
                     enabled=yaml_import.get('enabled'),
@@ -60,5 +613,20 @@ def load_from_yaml(rule_path: pathlib.PosixPath) -> Rule:
                     scope=yaml_import.get('scope'),
                     test_cases=test_cases,
                     strings=yaml_import.get('strings'),
-                    pattern=yaml_import.get('pattern'))
+                    pattern=yaml_import.get('pattern'),
+                    keywords=yaml_import.get('keywords'),
+                    match_timeout=match_timeout,
+                    category=pathlib.Path(rule_path).parent.name,
+                    entropy=yaml_import.get('entropy'))
+
+    if benchmark:
+        result = benchmark_pattern(rule.pattern)
+        if result.verdict == 'catastrophic':
+            raise Exception(f'Rule {rule.filename} rejected: pattern did not finish searching {result.worst_input} '
+                            f'within {BENCHMARK_TIMEOUT}s')
+        if result.verdict == 'super-linear':
+            warnings.warn(f'Rule {rule.filename}: search time grows with input size to the power of '
+                          f'{result.exponent:.1f} on {result.worst_input}')
+        else:
+            rule.match_timeout = None
     return rule
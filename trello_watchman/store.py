@@ -0,0 +1,272 @@
+import os
+import sqlite3
+import threading
+import time
+
+import simplejson as json
+
+DEFAULT_DB_NAME = 'trello_watchman.db'
+DEFAULT_BATCH_SIZE = 1000
+GROUP_FIELDS = ('rule', 'severity', 'board_id', 'card_id', 'scope')
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS findings ('
+    ' id INTEGER PRIMARY KEY,'
+    ' rule TEXT NOT NULL,'
+    ' scope TEXT NOT NULL,'
+    ' severity INTEGER,'
+    ' board_id TEXT,'
+    ' card_id TEXT NOT NULL,'
+    ' match TEXT NOT NULL,'
+    ' first_seen TEXT NOT NULL,'
+    ' last_seen TEXT NOT NULL,'
+    ' data TEXT NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS boards ('
+    ' id TEXT PRIMARY KEY,'
+    ' name TEXT,'
+    ' last_seen TEXT NOT NULL,'
+    ' data TEXT NOT NULL)',
+    # Unique per finding, so repeated audits update a finding rather than duplicate it.
+    # Also serves as the index on rule
+    'CREATE UNIQUE INDEX IF NOT EXISTS findings_rule_card_match ON findings (rule, scope, card_id, match)',
+    'CREATE INDEX IF NOT EXISTS findings_severity ON findings (severity)',
+    'CREATE INDEX IF NOT EXISTS findings_board ON findings (board_id)',
+    'CREATE INDEX IF NOT EXISTS findings_card ON findings (card_id)',
+    'CREATE INDEX IF NOT EXISTS findings_first_seen ON findings (first_seen)',
+    'CREATE INDEX IF NOT EXISTS findings_last_seen ON findings (last_seen)',
+]
+
+INSERT_FINDING = (
+    'INSERT INTO findings (rule, scope, severity, board_id, card_id, match, first_seen, last_seen, data)'
+    ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'
+    ' ON CONFLICT (rule, scope, card_id, match) DO UPDATE SET'
+    ' severity = excluded.severity, board_id = excluded.board_id, last_seen = excluded.last_seen,'
+    ' data = excluded.data')
+
+INSERT_BOARD = (
+    'INSERT INTO boards (id, name, last_seen, data) VALUES (?, ?, ?, ?)'
+    ' ON CONFLICT (id) DO UPDATE SET name = excluded.name, last_seen = excluded.last_seen, data = excluded.data')
+
+# Upserts (INSERT ... ON CONFLICT DO UPDATE) need SQLite 3.24. Older versions, still bundled with
+# some Python 3.6 and 3.7 builds, insert new rows and then update all rows in two statements
+UPSERT = sqlite3.sqlite_version_info >= (3, 24, 0)
+
+INSERT_FINDING_OR_IGNORE = (
+    'INSERT OR IGNORE INTO findings (rule, scope, severity, board_id, card_id, match, first_seen, last_seen, data)'
+    ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)')
+
+UPDATE_FINDING = (
+    'UPDATE findings SET severity = ?, board_id = ?, last_seen = ?, data = ?'
+    ' WHERE rule = ? AND scope = ? AND card_id = ? AND match = ?')
+
+INSERT_BOARD_OR_IGNORE = 'INSERT OR IGNORE INTO boards (id, name, last_seen, data) VALUES (?, ?, ?, ?)'
+
+UPDATE_BOARD = 'UPDATE boards SET name = ?, last_seen = ?, data = ? WHERE id = ?'
+
+
+def _severity(severity) -> int or None:
+    try:
+        return int(severity)
+    except (TypeError, ValueError):
+        return None
+
+
+def _get(item, name: str):
+    if isinstance(item, dict):
+        return item.get(name)
+    return getattr(item, name, None)
+
+
+class FindingsStore(object):
+    """Indexed SQLite store of findings, kept between runs
+
+    Findings are written in batches, each batch in a single transaction.
+    A finding is identified by its rule, scope, card and matched text (or
+    attachment IDs), so findings seen again in later audits update the
+    existing row and keep the time they were first seen. Boards are stored
+    once in their own table and findings reference them by ID. Each batch
+    writes the boards of its findings once, so board details stay current
+    without a write per finding. Findings can be added from several threads.
+
+    Attributes:
+        db_path: Path of the SQLite database file
+        batch_size: Number of findings buffered before they are written
+        written: Number of findings written during this run
+    """
+
+    def __init__(self, db_path: str, batch_size: int = DEFAULT_BATCH_SIZE):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.written = 0
+        self._findings = []
+        self._boards = {}
+        self._second = None
+        self._timestamp = None
+        self._lock = threading.RLock()
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.execute('PRAGMA synchronous = NORMAL')
+        with self.conn:
+            for statement in SCHEMA:
+                self.conn.execute(statement)
+
+    def _now(self) -> str:
+        second = int(time.time())
+        if second != self._second:
+            self._second = second
+            self._timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(second))
+        return self._timestamp
+
+    def add(self, finding, scope: str, rule: str, severity):
+        """Buffer a finding, writing the buffer if it is full
+
+        Args:
+            finding: Result object, or dict of a result referencing its board by ID
+            scope: Scope the finding was made in
+            rule: Name of the rule that made the finding
+            severity: Severity of the rule
+        """
+
+        board = _get(finding, 'board')
+        if board is not None:
+            self.add_board(board)
+            board_id = _get(board, 'id')
+        else:
+            board_id = _get(finding, 'board_id')
+        if hasattr(finding, 'as_reference'):
+            finding = finding.as_reference()
+
+        if finding.get('match_string') is not None:
+            match = finding.get('match_string')
+        else:
+            match = ','.join(str(_get(attachment, 'id')) for attachment in finding.get('attachments') or [])
+
+        data = json.dumps(finding)
+        with self._lock:
+            now = self._now()
+            self._findings.append((rule, scope, _severity(severity), board_id, finding.get('card_id'), match,
+                                   now, now, data))
+            if len(self._findings) >= self.batch_size:
+                self.flush()
+
+    def add_board(self, board):
+        """Buffer a board to store, once per batch
+
+        Args:
+            board: Board object or dict
+        """
+
+        board_id = _get(board, 'id')
+        with self._lock:
+            if board_id not in self._boards:
+                self._boards[board_id] = (board_id, _get(board, 'name'), self._now(), json.dumps(board))
+
+    def flush(self):
+        """Write buffered findings and boards in a single transaction"""
+
+        with self._lock:
+            if not self._findings and not self._boards:
+                return
+            with self.conn:
+                if UPSERT:
+                    self.conn.executemany(INSERT_BOARD, self._boards.values())
+                    self.conn.executemany(INSERT_FINDING, self._findings)
+                else:
+                    self.conn.executemany(INSERT_BOARD_OR_IGNORE, self._boards.values())
+                    self.conn.executemany(UPDATE_BOARD, ((name, last_seen, data, board_id)
+                                                         for board_id, name, last_seen, data in self._boards.values()))
+                    self.conn.executemany(INSERT_FINDING_OR_IGNORE, self._findings)
+                    self.conn.executemany(UPDATE_FINDING, ((severity, board_id, last_seen, data,
+                                                            rule, scope, card_id, match)
+                                                           for rule, scope, severity, board_id, card_id, match,
+                                                           first_seen, last_seen, data in self._findings))
+            self.written += len(self._findings)
+            self._findings = []
+            self._boards = {}
+
+    def close(self):
+        """Write any buffered findings and close the database"""
+
+        with self._lock:
+            self.flush()
+            self.conn.close()
+
+    @staticmethod
+    def _where(rules: list = None,
+               severity: int = None,
+               board_ids: list = None,
+               card_ids: list = None,
+               since: str = None,
+               before: str = None) -> tuple:
+        clauses = []
+        params = []
+        for column, values in (('rule', rules), ('board_id', board_ids), ('card_id', card_ids)):
+            if values:
+                clauses.append(f'{column} IN ({", ".join("?" * len(values))})')
+                params.extend(values)
+        if severity is not None:
+            clauses.append('severity >= ?')
+            params.append(severity)
+        if since:
+            clauses.append('first_seen >= ?')
+            params.append(since)
+        if before:
+            clauses.append('first_seen < ?')
+            params.append(before)
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    def query(self, limit: int = None, **filters):
+        """Get stored findings, newest first
+
+        Args:
+            limit: Maximum number of findings to return
+            filters: Any of rules, severity (minimum), board_ids, card_ids,
+                since (first seen at or after) and before (first seen before).
+                Times are 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM:SS' local time
+        Yields:
+            Dict for each finding, in the same layout as logged results
+        """
+
+        where, params = self._where(**filters)
+        sql = ('SELECT rule, scope, severity, first_seen, last_seen, data FROM findings'
+               f'{where} ORDER BY first_seen DESC, id DESC')
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        for rule, scope, severity, first_seen, last_seen, data in self.conn.execute(sql, params):
+            yield {
+                'first_seen': first_seen,
+                'last_seen': last_seen,
+                'scope': scope,
+                'severity': severity,
+                'detection_type': rule,
+                'detection_data': json.loads(data)
+            }
+
+    def count(self, group_by: str, limit: int = None, **filters) -> list:
+        """Count stored findings, grouped by one of GROUP_FIELDS
+
+        Args:
+            group_by: Field to group findings by
+            limit: Maximum number of groups to return
+            filters: Same filters as query
+        Returns:
+            List of (value, count) tuples, largest count first. Boards are
+            given as 'name (id)' where the board name is known
+        """
+
+        if group_by not in GROUP_FIELDS:
+            raise Exception(f'Cannot group findings by {group_by}, must be one of {", ".join(GROUP_FIELDS)}')
+        where, params = self._where(**filters)
+        sql = f'SELECT {group_by}, COUNT(*) FROM findings{where} GROUP BY {group_by} ORDER BY 2 DESC, 1'
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        counts = self.conn.execute(sql, params).fetchall()
+        if group_by == 'board_id':
+            names = dict(self.conn.execute('SELECT id, name FROM boards'))
+            counts = [(f'{names[board_id]} ({board_id})' if names.get(board_id) else board_id, total)
+                      for board_id, total in counts]
+        return counts
@@ -1,30 +1,115 @@
 import os
-import re
 import builtins
 import calendar
+import copy
+import itertools
 import requests
+import threading
 import time
 import yaml
 import simplejson as json
-from collections import namedtuple
 from requests.exceptions import HTTPError
 from requests.packages.urllib3.util import Retry
 from requests.adapters import HTTPAdapter
 
+from trello_watchman import cache
+from trello_watchman import jsonstream
 from trello_watchman import logger
+from trello_watchman import models
+from trello_watchman import profiler
 from trello_watchman import rule
+from trello_watchman.rule import MatchTimeout
 
-TEXT_RESULT = namedtuple('TextResult', ('card_id', 'last_activity', 'title', 'description', 'url',
-                                        'match_string', 'board'))
+TEXT_RESULT = models.TextResult
 
-ATTACHMENT_RESULT = namedtuple('AttachmentResult', ('card_id', 'last_activity', 'title', 'description', 'url',
-                                                    'attachments', 'board'))
+ATTACHMENT_RESULT = models.AttachmentResult
 
-BOARD = namedtuple('Board', ('id', 'name', 'description', 'closed', 'url', 'members'))
+BOARD = models.Board
 
-MEMBER = namedtuple('Member', ('id', 'username'))
+MEMBER = models.Member
 
-ATTACHMENT = namedtuple('Attachment', ('id', 'name', 'uploaded', 'filename', 'url'))
+ATTACHMENT = models.Attachment
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Cards from a search response matched together by entropy rules, so the entropy of the tokens
+# of several cards is calculated in one batch. Other rules match each card as it is decoded
+ENTROPY_BATCH = 50
+
+# Connections kept open to Trello. Parallel searches hold a streamed search connection
+# while making other requests, so this allows two per worker
+MAX_WORKERS = 16
+POOL_SIZE = MAX_WORKERS * 2
+
+# Trello allows 100 requests in any 10 seconds for each token. Requests are
+# limited to a burst of 10 followed by 9 per second, so no 10 second window exceeds 100
+RATE_LIMIT_REQUESTS = 100
+RATE_LIMIT_PERIOD = 10
+RATE_LIMIT_BURST = 10
+
+# Minimal parameters for each endpoint, only requesting the fields results are built from
+SEARCH_PARAMS = {
+    'modelTypes': 'cards',
+    'cards_limit': 1000,
+    'card_fields': 'name,desc,url,idBoard,dateLastActivity',
+    'card_attachments': 'true',
+}
+
+BOARD_PARAMS = {
+    'fields': 'name,desc,closed,url',
+}
+
+BOARD_MEMBERS_PARAMS = {
+    'fields': 'username',
+}
+
+ID_PARAMS = {
+    'fields': 'id',
+}
+
+CARD_ACTIONS_PARAMS = {
+    'filter': 'commentCard',
+    'fields': 'data',
+    'memberCreator': 'false',
+}
+
+
+class RateLimiter(object):
+    """Token bucket limiting the rate requests are made at. Shared by all threads
+    making requests on a connection, so parallel searches and concurrent daemon
+    jobs draw from the same budget. Each request reserves the next free slot,
+    so waiting requests are served in the order they arrived
+
+    Attributes:
+        burst: Number of requests that can be made at once after a pause
+        rate: Requests per second allowed after the burst
+        waited: Total seconds requests have waited for the limit
+    """
+
+    def __init__(self,
+                 requests: int = RATE_LIMIT_REQUESTS,
+                 period: float = RATE_LIMIT_PERIOD,
+                 burst: int = RATE_LIMIT_BURST):
+        self.burst = burst
+        self.rate = (requests - burst) / period
+        self.waited = 0
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Wait until a request can be made within the limit"""
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+            self.waited += wait
+        if wait:
+            with profiler.phase('rate limit'):
+                time.sleep(wait)
 
 
 class TrelloAPI(object):
@@ -35,43 +120,95 @@ class TrelloAPI(object):
         token: Trello OAuth token
         base_url: Base level URL for the Trello API
         session: Requests session object
+        boards: Board objects already built on this connection, by ID
+        members: Member objects already built on this connection, by ID
+        cache: ResponseCache object for GET requests, or None
+        rate_limiter: RateLimiter object requests wait on, or None for no limit
+        requests_made: Number of requests sent to Trello, including by run connections from for_run
+        bytes_received: Total size of the response bodies received from Trello, including by run connections
     """
 
-    def __init__(self, key: str, token: str):
+    def __init__(self, key: str, token: str, response_cache: cache.ResponseCache = None,
+                 rate_limiter: RateLimiter = None):
         """Inits DigitalShadowsAPI with base URL and required API arguments.
         Creates a requests session, mounts it and auths it.
 
         Args:
             key: Trello API OAuth key
             token: Trello API OAuth token
+            response_cache: ResponseCache object to cache GET requests in between runs
+            rate_limiter: RateLimiter object to limit requests with, or None for no limit
         """
 
         self.key = key
         self.token = token
         self.base_url = 'https://api.trello.com'
+        self.cache = response_cache
+        self.rate_limiter = rate_limiter
+        self.requests_made = 0
+        self.bytes_received = 0
+        self.boards = {}
+        self.members = {}
+        self._lock = threading.Lock()
+        self._counted = (self,)
         self.session = session = requests.session()
-        session.mount(self.base_url, HTTPAdapter(max_retries=Retry(connect=3, backoff_factor=1)))
-        session.headers.update({'Authorization': f'OAuth oauth_consumer_key="{self.key}", oauth_token="{self.token}"'})
-        session.params.update({
-            'cards_limit': 1000,
-            'card_members': 'true',
-            'card_attachments': 'true',
-            'members_limit': 100,
-            'boards_limit': 1000,
-            'board': 'true',
-            'modelTypes': ['cards', 'boards'],
-        })
+        session.mount(self.base_url, HTTPAdapter(max_retries=Retry(connect=3, backoff_factor=1),
+                                                 pool_maxsize=POOL_SIZE))
+        session.headers.update({'Authorization': f'OAuth oauth_consumer_key="{self.key}", oauth_token="{self.token}"',
+                                'Accept-Encoding': 'gzip'})
+
+    def for_run(self) -> 'TrelloAPI':
+        """Get a connection for one run, such as a daemon job run, sharing this
+        connection's session, cache and rate limiter. The run connection interns its
+        own boards and members, so runs going at the same time don't reset each other's,
+        and counts its own requests as well as adding them to this connection's totals
+
+        Returns:
+            TrelloAPI object for the run
+        """
+
+        run_connection = copy.copy(self)
+        run_connection.boards = {}
+        run_connection.members = {}
+        run_connection.requests_made = 0
+        run_connection.bytes_received = 0
+        run_connection._counted = self._counted + (run_connection,)
+        return run_connection
 
     def _make_request(self,
                       url: str,
                       params: dict or str = None,
                       data: dict or str = None,
                       method: str = 'GET',
-                      verify_ssl: bool = True) -> requests.Response:
+                      verify_ssl: bool = True,
+                      stream: bool = False) -> requests.Response:
         try:
             relative_url = '/'.join((self.base_url, '1', url))
-            response = self.session.request(method, relative_url, params=params, data=data, verify=verify_ssl)
+            headers = {}
+            cache_key = cache_entry = None
+            if self.cache and method == 'GET' and not stream:
+                cache_key = self.cache.make_key(self.key, self.token, relative_url, params)
+                cache_entry = self.cache.get(cache_key)
+                if cache_entry:
+                    if self.cache.is_fresh(cache_entry):
+                        return self.cache.hit(cache_key, cache_entry)
+                    headers = self.cache.conditional_headers(cache_entry)
+
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            with profiler.phase('network'):
+                response = self.session.request(method, relative_url, params=params, data=data, headers=headers,
+                                                verify=verify_ssl, stream=stream)
+            with self._lock:
+                for connection in self._counted:
+                    connection.requests_made += 1
+                    if not stream:
+                        connection.bytes_received += len(response.content)
+            if cache_entry and response.status_code == 304:
+                return self.cache.hit(cache_key, cache_entry)
             response.raise_for_status()
+            if cache_key:
+                self.cache.put(cache_key, response)
 
             return response
 
@@ -84,7 +221,11 @@ class TrelloAPI(object):
             elif response.status_code == 429:
                 print('Rate limit hit, cooling off...')
                 time.sleep(90)
-                response = self.session.request(method, relative_url, params=params, data=data, verify=verify_ssl)
+                if self.rate_limiter:
+                    self.rate_limiter.acquire()
+                with profiler.phase('network'):
+                    response = self.session.request(method, relative_url, params=params, data=data,
+                                                    verify=verify_ssl, stream=stream)
                 response.raise_for_status()
 
                 return response
@@ -94,6 +235,11 @@ class TrelloAPI(object):
         except Exception as e:
             print(e)
 
+    def _get_json(self, url: str, params: dict = None) -> json:
+        response = self._make_request(url, params=params)
+        with profiler.phase('json decoding'):
+            return response.json()
+
     def get_me(self):
         """Get Trello account information on the user the OAuth token
         is linked to
@@ -102,7 +248,7 @@ class TrelloAPI(object):
             JSON object containing Trello data for the user of the API token
         """
 
-        return self._make_request('members/me').json()
+        return self._get_json('members/me')
 
     def get_card(self, card_id: str) -> json:
         """Get Trello card by ID
@@ -113,10 +259,10 @@ class TrelloAPI(object):
             JSON object containing Trello card data
         """
 
-        return self._make_request(f'cards/{card_id}').json()
+        return self._get_json(f'cards/{card_id}')
 
     def get_card_actions(self, card_id: str) -> json:
-        """Get actions carried out on a card by ID
+        """Get comments made on a card by ID
 
         Args:
             card_id: ID number for the Trello card to retrieve actions for
@@ -124,7 +270,7 @@ class TrelloAPI(object):
             JSON object containing Trello card actions data
         """
 
-        return self._make_request(f'cards/{card_id}/actions').json()
+        return self._get_json(f'cards/{card_id}/actions', params=CARD_ACTIONS_PARAMS)
 
     def get_board(self, board_id: str) -> json:
         """Get Trello board by ID
@@ -135,7 +281,7 @@ class TrelloAPI(object):
             JSON object containing Trello board data
         """
 
-        return self._make_request(f'boards/{board_id}').json()
+        return self._get_json(f'boards/{board_id}', params=BOARD_PARAMS)
 
     def get_board_members(self, board_id: str) -> json:
         """Get Trello board members by ID
@@ -146,7 +292,7 @@ class TrelloAPI(object):
             JSON object containing Trello board members data
         """
 
-        return self._make_request(f'boards/{board_id}/members').json()
+        return self._get_json(f'boards/{board_id}/members', params=BOARD_MEMBERS_PARAMS)
 
     def get_member(self, member_id: str) -> json:
         """Get Trello member by ID
@@ -157,28 +303,118 @@ class TrelloAPI(object):
             JSON object containing Trello member data
         """
 
-        return self._make_request(f'members/{member_id}').json()
+        return self._get_json(f'members/{member_id}')
+
+    def get_my_boards(self) -> json:
+        """Get the boards the user of the OAuth token is a member of
+
+        Returns:
+            JSON object containing the IDs of the boards
+        """
+
+        return self._get_json('members/me/boards', params=ID_PARAMS)
+
+    def get_my_organizations(self) -> json:
+        """Get the organizations the user of the OAuth token is a member of
+
+        Returns:
+            JSON object containing the IDs of the organizations
+        """
+
+        return self._get_json('members/me/organizations', params=ID_PARAMS)
 
-    def search(self, query: str) -> json:
+    def get_organization(self, organization_id: str) -> json:
+        """Get Trello organization by ID or name
+
+        Args:
+            organization_id: ID or name of the Trello organization to retrieve
+        Returns:
+            JSON object containing the ID of the organization
+        """
+
+        return self._get_json(f'organizations/{organization_id}', params=ID_PARAMS)
+
+    def get_organization_boards(self, organization_id: str) -> json:
+        """Get the boards in a Trello organization
+
+        Args:
+            organization_id: ID or name of the Trello organization
+        Returns:
+            JSON object containing the IDs of the boards
+        """
+
+        return self._get_json(f'organizations/{organization_id}/boards', params=ID_PARAMS)
+
+    @staticmethod
+    def _search_params(query: str, board_ids: list = None, organization_ids: list = None) -> dict:
+        params = dict(SEARCH_PARAMS, query=query)
+        if board_ids:
+            params['idBoards'] = ','.join(board_ids)
+        if organization_ids:
+            params['idOrganizations'] = ','.join(organization_ids)
+        return params
+
+    def search(self, query: str, board_ids: list = None, organization_ids: list = None) -> json:
         """Search Trello for matches to the given query
 
         Args:
             query: String query to search across Trello for
+            board_ids: IDs of the boards to restrict the search to
+            organization_ids: IDs of the organizations to restrict the search to
         Returns:
             JSON object containing Trello search results
         """
 
-        self.session.params.update({
-            'query': query,
-        })
+        return self._get_json('search', params=self._search_params(query, board_ids, organization_ids))
 
-        return self._make_request('search').json()
+    def search_cards(self, query: str, board_ids: list = None, organization_ids: list = None):
+        """Search Trello for cards matching the given query. The response is
+        decoded incrementally, so cards are yielded as they are received rather
+        than after the whole response has been loaded. Streamed responses are
+        not cached
 
+        Args:
+            query: String query to search across Trello for
+            board_ids: IDs of the boards to restrict the search to
+            organization_ids: IDs of the organizations to restrict the search to
+        Yields:
+            JSON object for each card in the Trello search results
+        """
 
-def initiate_trello_connection() -> TrelloAPI:
+        response = self._make_request('search', params=self._search_params(query, board_ids, organization_ids),
+                                      stream=True)
+        try:
+            cards = jsonstream.iter_array(self._read_chunks(response), 'cards')
+            while True:
+                with profiler.phase('json decoding'):
+                    card = next(cards, None)
+                if card is None:
+                    return
+                yield card
+        finally:
+            response.close()
+
+    def _read_chunks(self, response: requests.Response):
+        chunks = response.iter_content(STREAM_CHUNK_SIZE)
+        while True:
+            with profiler.phase('network'):
+                chunk = next(chunks, None)
+            if chunk is None:
+                return
+            with self._lock:
+                for connection in self._counted:
+                    connection.bytes_received += len(chunk)
+            yield chunk
+
+
+def initiate_trello_connection(response_cache: cache.ResponseCache = None,
+                               rate_limiter: RateLimiter = None) -> TrelloAPI:
     """Checks for credentials in environment variables of .conf file.
     If present, creates a Trello API client object authed to those credentials
 
+    Args:
+        response_cache: ResponseCache object to cache GET requests in, or None to disable caching
+        rate_limiter: RateLimiter object to limit requests with, or None for no limit
     Returns:
         Trello API object
     """
@@ -200,22 +436,56 @@ def initiate_trello_connection() -> TrelloAPI:
 
         key = config.get('trello_watchman').get('key')
 
-    return TrelloAPI(key, secret)
+    return TrelloAPI(key, secret, response_cache, rate_limiter)
+
+
+def get_board_result(trello: TrelloAPI, board_id: str) -> models.Board:
+    """Get the Board object for a board ID, fetching the board and its members
+    from Trello the first time it is seen. Boards and members are interned on
+    the connection, so all results on a board share the same objects. Parallel
+    searches may fetch a board at the same time, but only the first object
+    stored is used
+
+    Args:
+        trello: TrelloAPI object with authed connection to Trello
+        board_id: ID of the Trello board
+    Returns:
+        Board object shared by all results on the board
+    """
+
+    board_result = trello.boards.get(board_id)
+    if board_result is None:
+        board = trello.get_board(board_id)
+        members = []
+        for member in trello.get_board_members(board_id):
+            member_result = trello.members.get(member.get('id'))
+            if member_result is None:
+                member_result = trello.members.setdefault(member.get('id'),
+                                                          MEMBER(member.get('id'), member.get('username')))
+            members.append(member_result)
+
+        board_result = trello.boards.setdefault(board_id, BOARD(board.get('id'),
+                                                                board.get('name'),
+                                                                board.get('desc'),
+                                                                board.get('closed'),
+                                                                board.get('url'),
+                                                                tuple(members)))
+    return board_result
 
 
 def deduplicate(input_list: list) -> list:
     """Removes duplicates where results are returned by multiple queries
 
     Args:
-        input_list: list of dict results to remove duplicate entries from
+        input_list: list of results to remove duplicate entries from
     Returns:
-        De-duplicated list of results
+        De-duplicated list of results, keeping the first result for each card
     """
 
-    list_of_strings = [json.dumps(d) for d in input_list]
-    list_of_strings = set(list_of_strings)
-    deduped_list = [json.loads(s) for s in list_of_strings]
-    return list({match.get('card_id'): match for match in reversed(deduped_list)}.values())
+    deduped_results = {}
+    for match in input_list:
+        deduped_results.setdefault(match.card_id, match)
+    return list(deduped_results.values())
 
 
 def convert_time(timestamp: str) -> int:
@@ -235,7 +505,9 @@ def convert_time(timestamp: str) -> int:
 def find_attachments(trello: TrelloAPI,
                      log_handler: logger.Logger,
                      rule: rule.Rule,
-                     timeframe=calendar.timegm(time.gmtime()) + 1576800000) -> list:
+                     timeframe=calendar.timegm(time.gmtime()) + 1576800000,
+                     board_ids: list = None,
+                     organization_ids: list = None) -> list:
     """ Search Trello for attachments in cards based on the given rule and timeframe
 
     Args:
@@ -243,8 +515,10 @@ def find_attachments(trello: TrelloAPI,
         log_handler: Logger object for outputting results
         rule: Rule object containing what to search for
         timeframe: Time period to search back
+        board_ids: IDs of the boards to restrict the search to
+        organization_ids: IDs of the organizations to restrict the search to
     Returns:
-        A list containing dict objects ready to be logged as JSON
+        A list containing AttachmentResult objects ready to be logged as JSON
     """
 
     results = []
@@ -256,32 +530,19 @@ def find_attachments(trello: TrelloAPI,
         print = builtins.print
 
     for query in rule.strings:
-        card_list = trello.search(query).get('cards')
-        formatted_query = str(query).replace('"', '')
-        print(f'{len(card_list)} cards found matching: {formatted_query}')
-        for card in card_list:
+        card_count = 0
+        for card in trello.search_cards(query, board_ids, organization_ids):
+            card_count += 1
             if card.get('attachments') and convert_time(card.get('dateLastActivity')) > (now - timeframe):
-                board = trello.get_board(card.get('idBoard'))
-                board_members = trello.get_board_members(card.get('idBoard'))
-
-                members = []
-                for member in board_members:
-                    members.append(MEMBER(member.get('id'), member.get('username')))
-
-                board_result = BOARD(board.get('id'),
-                                     board.get('name'),
-                                     board.get('desc'),
-                                     board.get('closed'),
-                                     board.get('url'),
-                                     members)
+                board_result = get_board_result(trello, card.get('idBoard'))
 
                 attachments = []
                 for attachment in card.get('attachments'):
-                    attachments.append(ATTACHMENT(attachment.get('id'),
-                                                  attachment.get('date'),
-                                                  attachment.get('name'),
-                                                  attachment.get('fileName'),
-                                                  attachment.get('url')))
+                    attachments.append(ATTACHMENT(id=attachment.get('id'),
+                                                  name=attachment.get('name'),
+                                                  uploaded=attachment.get('date'),
+                                                  filename=attachment.get('fileName'),
+                                                  url=attachment.get('url')))
 
                 attachment_result = ATTACHMENT_RESULT(card.get('id'),
                                                       card.get('dateLastActivity'),
@@ -292,6 +553,8 @@ def find_attachments(trello: TrelloAPI,
                                                       board_result)
 
                 results.append(attachment_result)
+        formatted_query = str(query).replace('"', '')
+        print(f'{card_count} cards found matching: {formatted_query}')
 
     if results:
         results = deduplicate(results)
@@ -304,7 +567,9 @@ def find_attachments(trello: TrelloAPI,
 def find_text(trello: TrelloAPI,
               log_handler: logger.Logger,
               rule: rule.Rule,
-              timeframe=calendar.timegm(time.gmtime()) + 1576800000):
+              timeframe=calendar.timegm(time.gmtime()) + 1576800000,
+              board_ids: list = None,
+              organization_ids: list = None):
     """ Search Trello for text in cards based on the given rule and timeframe
 
         Args:
@@ -312,8 +577,10 @@ def find_text(trello: TrelloAPI,
             log_handler: Logger object for outputting results
             rule: Rule object containing what to search for
             timeframe: Time period to search back
+            board_ids: IDs of the boards to restrict the search to
+            organization_ids: IDs of the organizations to restrict the search to
         Returns:
-            A list containing dict objects ready to be logged as JSON
+            A list containing TextResult objects ready to be logged as JSON
     """
 
     results = []
@@ -324,42 +591,44 @@ def find_text(trello: TrelloAPI,
     else:
         print = builtins.print
 
-    for query in rule.strings:
-        card_list = trello.search(query).get('cards')
-        formatted_query = str(query).replace('"', '')
-        print(f'{len(card_list)} cards found matching: {formatted_query}')
-        for card in card_list:
-            if convert_time(card.get('dateLastActivity')) > (now - timeframe):
-                board = trello.get_board(card.get('idBoard'))
-                board_members = trello.get_board_members(card.get('idBoard'))
-                actions = trello.get_card_actions(card.get('id'))
-                r = re.compile(rule.pattern)
-                if r.search(str(card.get('desc'))):
-                    members = []
-                    for member in board_members:
-                        members.append(MEMBER(member.get('id'), member.get('username')))
-
-                    board_result = BOARD(board.get('id'),
-                                         board.get('name'),
-                                         board.get('desc'),
-                                         board.get('closed'),
-                                         board.get('url'),
-                                         members)
-
-                    text_result = TEXT_RESULT(card.get('id'),
-                                              card.get('dateLastActivity'),
-                                              card.get('name'),
-                                              card.get('desc'),
-                                              card.get('url'),
-                                              r.search(str(card.get('desc'))).group(0),
-                                              board_result)
-
-                    if r.search(str(card.get('desc'))) or r.search(str(card.get('name'))):
+    batch_size = ENTROPY_BATCH if rule.detector else 1
+    try:
+        for query in rule.strings:
+            card_count = 0
+            cards = trello.search_cards(query, board_ids, organization_ids)
+            while True:
+                batch = list(itertools.islice(cards, batch_size))
+                if not batch:
+                    break
+                card_count += len(batch)
+                batch = [card for card in batch if convert_time(card.get('dateLastActivity')) > (now - timeframe)]
+                matches = rule.search_many([str(card.get('desc')) for card in batch])
+                unmatched = [index for index, match in enumerate(matches) if not match]
+                for index, match in zip(unmatched, rule.search_many([str(batch[index].get('name'))
+                                                                     for index in unmatched])):
+                    matches[index] = match
+
+                for card, match in zip(batch, matches):
+                    if not match:
+                        comments = [str(entry.get('data', {}).get('text'))
+                                    for entry in trello.get_card_actions(card.get('id'))]
+                        match = next((match for match in rule.search_many(comments) if match), None)
+                    if match:
+                        board_result = get_board_result(trello, card.get('idBoard'))
+
+                        text_result = TEXT_RESULT(card.get('id'),
+                                                  card.get('dateLastActivity'),
+                                                  card.get('name'),
+                                                  card.get('desc'),
+                                                  card.get('url'),
+                                                  match.group(0),
+                                                  board_result)
+
                         results.append(text_result)
-                    else:
-                        for entry in actions:
-                            if r.search(str(entry.get('text'))):
-                                results.append(text_result)
+            formatted_query = str(query).replace('"', '')
+            print(f'{card_count} cards found matching: {formatted_query}')
+    except MatchTimeout as e:
+        print(f'Skipping rule, regex time budget exceeded: {e}')
     if results:
         results = deduplicate(results)
         print(f'{len(results)} total matches found after filtering')